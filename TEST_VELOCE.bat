@@ -13,11 +13,11 @@ py scraper.py ^
   --min-delay 0.1 ^
   --max-delay 0.3 ^
   --max-concurrent 10 ^
-  --save-to test_veloce.json ^
+  --save-to test_veloce.jsonl ^
   --headful
 
 echo.
 echo ========================================
-echo Test completato! Risultati in: test_veloce.json
+echo Test completato! Risultati in: test_veloce.jsonl
 echo ========================================
 pause
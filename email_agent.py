@@ -10,21 +10,37 @@ Requisiti:
 """
 
 import argparse
-import json
+import logging
+import logging.handlers
 import os
+import re
 import smtplib
+import ssl
+import sys
+import threading
 import time
-from dataclasses import dataclass
-from email.mime.multipart import MIMEMultipart
+from collections import deque
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from contextlib import ExitStack, contextmanager
+from dataclasses import dataclass, field
+from functools import lru_cache
 from email.mime.text import MIMEText
+from itertools import islice
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
 
 import gspread
-from jinja2 import Environment, FileSystemLoader, Template
+from gspread.exceptions import APIError
+from gspread.utils import absolute_range_name, rowcol_to_a1
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, Template
 
+try:
+    import orjson as _json  # Parser C, più veloce del modulo json standard
+except ImportError:  # orjson è opzionale: fallback sulla libreria standard
+    import json as _json
 
-@dataclass
+
+@dataclass(slots=True)
 class RecipientData:
     """Dati del destinatario estratti da Google Sheets."""
     email: str
@@ -35,11 +51,9 @@ class RecipientData:
     location: str
     # Campi aggiuntivi opzionali
     row_number: int = 0
-    extra_data: Dict[str, Any] = None
-
-    def __post_init__(self):
-        if self.extra_data is None:
-            self.extra_data = {}
+    extra_data: Dict[str, Any] = field(default_factory=dict)
+    # Altre righe del foglio con lo stesso indirizzo (marcate insieme a questa)
+    duplicate_rows: List[int] = field(default_factory=list)
 
     def to_dict(self) -> Dict[str, Any]:
         """Converte i dati in dizionario per il template Jinja2."""
@@ -55,6 +69,151 @@ class RecipientData:
         }
 
 
+@dataclass(slots=True)
+class RenderedEmail:
+    """Email già renderizzata per un destinatario, pronta per l'invio."""
+    recipient: RecipientData
+    subject: str
+    body: str
+    # Destinatari con lo stesso oggetto/corpo spediti in Ccn nello stesso DATA
+    bcc: List[RecipientData] = field(default_factory=list)
+
+
+@dataclass
+class SmtpConfig:
+    """Parametri della connessione SMTP usata per l'invio."""
+    email: str
+    password: str
+    host: str = "smtp.gmail.com"
+    port: int = 465
+    use_ssl: bool = True  # True: SMTP_SSL (TLS implicito), False: SMTP + STARTTLS
+
+
+class RateLimiter:
+    """
+    Limitatore a finestra scorrevole: al massimo `rate` invii ogni `period` secondi.
+
+    Attende solo quando la finestra è piena, quindi il tempo già speso
+    nel round-trip SMTP conta nel budget invece di sommarsi a un delay fisso.
+    """
+
+    def __init__(self, rate: int, period: float = 60.0):
+        self.period = period
+        self.sent: Deque[float] = deque(maxlen=rate)
+        # Condiviso tra i thread di invio: il limite resta globale
+        self.lock = threading.Lock()
+
+    def wait(self) -> None:
+        """Blocca finché un nuovo invio non rientra nel limite, poi lo registra."""
+        with self.lock:
+            if len(self.sent) == self.sent.maxlen:
+                sleep_for = self.period - (time.monotonic() - self.sent[0])
+                if sleep_for > 0:
+                    time.sleep(sleep_for)
+            self.sent.append(time.monotonic())
+
+
+class EmailAgentAbort(Exception):
+    """Invio interrotto perché troppe email stanno fallendo."""
+
+
+class SendStats:
+    """
+    Contatori di invio condivisi tra i thread, con interruzione anticipata.
+
+    Superate `min_batch` email, se la quota di errori supera `max_failure_ratio`
+    l'invio si ferma: password sbagliata, mittente bloccato o limite del
+    provider fanno fallire anche tutte le email successive.
+    """
+
+    def __init__(self, max_failure_ratio: float, min_batch: int):
+        self.max_failure_ratio = max_failure_ratio
+        self.min_batch = min_batch
+        self.success = 0
+        self.errors = 0
+        self.aborted = False
+        self.interrupted = False
+        self.lock = threading.Lock()
+
+    def record(self, ok: bool) -> None:
+        """Registra l'esito di un invio; solleva EmailAgentAbort oltre la soglia."""
+        with self.lock:
+            if ok:
+                self.success += 1
+            else:
+                self.errors += 1
+            done = self.success + self.errors
+            if done >= self.min_batch and self.errors / done > self.max_failure_ratio:
+                self.aborted = True
+        if self.aborted:
+            self.check()
+
+    def stop(self) -> None:
+        """Chiede a tutti i thread di fermarsi prima del prossimo invio (Ctrl+C)."""
+        self.interrupted = True
+
+    def check(self) -> None:
+        """Solleva EmailAgentAbort se un qualunque thread ha già interrotto l'invio."""
+        if self.interrupted:
+            raise EmailAgentAbort("interrotto dall'utente")
+        if self.aborted:
+            raise EmailAgentAbort(f"failure ratio exceeded ({self.errors}/{self.success + self.errors} errori)")
+
+
+logger = logging.getLogger("email_agent")
+
+# Validazione sintattica minima degli indirizzi letti dal foglio
+_EMAIL_RE = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+
+# Marker HTML nel corpo renderizzato (usato solo se il template non è .html)
+_HTML_RE = re.compile(r"<html|<body|<p>", re.IGNORECASE)
+
+# Delimitatori Jinja2 ({{ }}, {% %}, {# #}): senza di essi l'oggetto è costante
+_PLACEHOLDER_RE = re.compile(r"\{[{%#]")
+
+# Segnaposto del vecchio --subject basato su str.format: {keyword}
+_FORMAT_FIELD_RE = re.compile(r"\{(\w+)\}")
+
+# Un Environment Jinja2 per cartella template, creato una sola volta per processo
+_ENV_CACHE: Dict[Path, Environment] = {}
+
+# Marcature "Inviata" in attesa di essere scritte con una sola chiamata API
+_pending_marks: List[Dict[str, Any]] = []
+_marks_lock = threading.Lock()
+MARK_FLUSH_EVERY = 25
+MARK_FLUSH_ATTEMPTS = 3
+# Lunghezza della coda che fa partire il prossimo flush automatico: dopo un errore
+# si aspettano altre MARK_FLUSH_EVERY marcature invece di riprovare a ogni email
+_next_flush_at = MARK_FLUSH_EVERY
+
+# Stati HTTP di Google Sheets per cui ha senso ritentare una scrittura
+_RETRYABLE_SHEETS_STATUS = frozenset({429, 500, 502, 503, 504})
+
+# Tentativi di apertura di una sessione SMTP prima di rinunciare al blocco di messaggi
+SMTP_CONNECT_ATTEMPTS = 3
+
+# Bytecode dei template compilati, persistito tra un'esecuzione e l'altra
+DEFAULT_JINJA_CACHE_DIR = os.path.join("~", ".cache", "email_agent_jinja")
+
+
+def setup_logging(verbose: bool = False, quiet: bool = False) -> None:
+    """
+    Configura il logging su stdout.
+
+    I messaggi per singola email sono DEBUG (visibili solo con --verbose) e
+    vengono accumulati in memoria: finiscono su stdout in un'unica scrittura
+    al primo messaggio INFO o superiore, o ogni 200 record.
+    """
+    level = logging.DEBUG if verbose else logging.WARNING if quiet else logging.INFO
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(logging.Formatter("%(message)s"))
+    buffered = logging.handlers.MemoryHandler(
+        capacity=200, flushLevel=logging.INFO, target=stream_handler
+    )
+    logger.addHandler(buffered)
+    logger.setLevel(level)
+
+
 def parse_args() -> argparse.Namespace:
     """Parse degli argomenti da riga di comando."""
     parser = argparse.ArgumentParser(
@@ -75,10 +234,15 @@ def parse_args() -> argparse.Namespace:
         required=True,
         help="Percorso al file template email (formato Jinja2).",
     )
+    parser.add_argument(
+        "--jinja-cache-dir",
+        default=DEFAULT_JINJA_CACHE_DIR,
+        help="Cartella per la cache del bytecode dei template (default: ~/.cache/email_agent_jinja).",
+    )
     parser.add_argument(
         "--subject",
         required=True,
-        help="Oggetto dell'email (può contenere variabili Jinja2).",
+        help="Oggetto dell'email (può contenere variabili Jinja2, es. {{ keyword }}; il vecchio formato {keyword} viene convertito).",
     )
     parser.add_argument(
         "--service-account",
@@ -96,6 +260,22 @@ def parse_args() -> argparse.Namespace:
         "--gmail-password",
         help="App Password Gmail (oppure setta env GMAIL_APP_PASSWORD).",
     )
+    parser.add_argument(
+        "--smtp-host",
+        default="smtp.gmail.com",
+        help="Server SMTP (default: smtp.gmail.com).",
+    )
+    parser.add_argument(
+        "--smtp-port",
+        type=int,
+        help="Porta SMTP (default: 465 con --smtp-ssl, 587 con --no-smtp-ssl).",
+    )
+    parser.add_argument(
+        "--smtp-ssl",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="TLS implicito (SMTP_SSL); con --no-smtp-ssl usa STARTTLS (default: attivo).",
+    )
     parser.add_argument(
         "--sender-name",
         default="Email Agent",
@@ -106,6 +286,16 @@ def parse_args() -> argparse.Namespace:
         action="store_true",
         help="Modalità test: mostra le email senza inviarle.",
     )
+    parser.add_argument(
+        "--verbose",
+        action="store_true",
+        help="Mostra il dettaglio di ogni singola email.",
+    )
+    parser.add_argument(
+        "--quiet",
+        action="store_true",
+        help="Mostra solo avvisi ed errori.",
+    )
     parser.add_argument(
         "--start-row",
         type=int,
@@ -121,7 +311,45 @@ def parse_args() -> argparse.Namespace:
         "--delay",
         type=float,
         default=2.0,
-        help="Delay in secondi tra un'email e l'altra (default: 2.0).",
+        help="Secondi minimi tra un invio e il successivo, su tutti i thread insieme (default: 2.0, ignorato con --rate-per-minute).",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=4,
+        help="Connessioni SMTP parallele (thread di invio, default: 4).",
+    )
+    parser.add_argument(
+        "--rate-per-minute",
+        type=int,
+        help="Limite massimo di email al minuto (finestra scorrevole, sostituisce --delay).",
+    )
+    parser.add_argument(
+        "--emails-per-connection",
+        type=int,
+        default=100,
+        help="Messaggi inviati per connessione SMTP prima di riaprirla (default: 100).",
+    )
+    parser.add_argument(
+        "--rcpt-batch",
+        type=int,
+        default=1,
+        help=(
+            "Destinatari massimi per messaggio quando oggetto e corpo renderizzati sono identici: "
+            "inviati in Ccn con un solo DATA SMTP (default: 1, un messaggio per destinatario)."
+        ),
+    )
+    parser.add_argument(
+        "--abort-failure-ratio",
+        type=float,
+        default=0.33,
+        help="Interrompe l'invio se la quota di email fallite supera questa soglia (default: 0.33).",
+    )
+    parser.add_argument(
+        "--abort-min-batch",
+        type=int,
+        default=30,
+        help="Email minime tentate prima di valutare --abort-failure-ratio (default: 30).",
     )
     parser.add_argument(
         "--skip-sent",
@@ -136,24 +364,17 @@ def parse_args() -> argparse.Namespace:
     return parser.parse_args()
 
 
+@lru_cache(maxsize=4)
 def build_gspread_client(
     service_account_path: Optional[str], service_account_json: Optional[str]
 ) -> gspread.Client:
-    """Costruisce il client gspread per accedere a Google Sheets."""
-    if service_account_json:
-        data = json.loads(service_account_json)
-        return gspread.service_account_from_dict(data)
-    env_json = os.getenv("SERVICE_ACCOUNT_JSON")
-    if env_json:
-        data = json.loads(env_json)
-        return gspread.service_account_from_dict(data)
-    if service_account_path:
-        path_obj = Path(service_account_path)
-        if path_obj.exists():
-            return gspread.service_account(filename=str(path_obj))
-    env_path = os.getenv("SERVICE_ACCOUNT_FILE")
-    if env_path and Path(env_path).exists():
-        return gspread.service_account(filename=env_path)
+    """Costruisce il client gspread per accedere a Google Sheets (memoizzato per parametri)."""
+    # Priorità: JSON inline (argomento o env), poi file (argomento o env)
+    if inline_json := service_account_json or os.environ.get("SERVICE_ACCOUNT_JSON"):
+        return gspread.service_account_from_dict(_json.loads(inline_json))
+    for path in (service_account_path, os.environ.get("SERVICE_ACCOUNT_FILE")):
+        if path and Path(path).exists():
+            return gspread.service_account(filename=str(path))
     raise ValueError(
         "Service account mancante: passa --service-account o --service-account-json o variabile env."
     )
@@ -177,16 +398,24 @@ def load_recipients(
     
     Assume struttura: Email, Phone, Website, Keyword, Nome proprietario, Location
     """
+    # Solo le righe necessarie: header + [start_row, start_row + max_emails),
+    # lette con una sola values.batchGet invece di scaricare tutto il foglio
+    end_row = start_row + max_emails - 1 if max_emails else max(ws.row_count, start_row)
     try:
-        all_values = ws.get_all_values()
+        response = ws.spreadsheet.values_batch_get(
+            [absolute_range_name(ws.title, "1:1"), absolute_range_name(ws.title, f"{start_row}:{end_row}")]
+        )
+        header_range, body_range = response["valueRanges"]
+        header_rows = header_range.get("values", [])
+        body_rows = body_range.get("values", [])
     except Exception as e:
         raise ValueError(f"Errore nel leggere il foglio: {e}")
 
-    if len(all_values) < start_row:
+    if not body_rows:
         return []
 
     # Trova l'indice della colonna "Inviata" se esiste
-    headers = all_values[0] if all_values else []
+    headers = header_rows[0] if header_rows else []
     sent_col_idx = None
     if skip_sent and sent_column:
         try:
@@ -194,53 +423,72 @@ def load_recipients(
         except ValueError:
             sent_col_idx = None
 
-    recipients: List[RecipientData] = []
-    end_row = len(all_values)
-    if max_emails:
-        end_row = min(start_row + max_emails, len(all_values))
+    # values.get omette le celle vuote in coda: allinea le righe alla larghezza dell'header
+    width = len(headers)
+    extra_headers = headers[6:]
+    check_sent = skip_sent and sent_col_idx is not None
 
-    for idx in range(start_row - 1, end_row):  # -1 perché è 0-based
-        row = all_values[idx]
+    kept: List[Tuple[int, List[str]]] = []
+    for row_number, row in enumerate(body_rows, start_row):
+        if len(row) < width:
+            row += [""] * (width - len(row))
         if len(row) < 6:  # Almeno 6 colonne attese
             continue
 
-        # Salta se già inviata (cerca "sì"/"si"/"yes") o se non ha "no" quando skip_sent è attivo
-        if skip_sent and sent_col_idx is not None and sent_col_idx < len(row):
-            sent_value = row[sent_col_idx].strip().lower()
-            # Salta se già inviata
-            if sent_value in ["sì", "si", "yes", "y", "1", "true"]:
-                continue
-            # Se skip_sent è attivo, processa SOLO righe con "no"
-            if sent_value != "no":
-                continue
-
-        email = row[0].strip() if len(row) > 0 else ""
-        if not email or "@" not in email:
+        # Con skip_sent processa SOLO righe con "no" (quindi salta anche "sì"/"yes"/...)
+        if check_sent and row[sent_col_idx].strip().lower() != "no":
             continue
+        kept.append((row_number, row))
 
-        recipient = RecipientData(
-            email=email,
-            phone=row[1].strip() if len(row) > 1 else "",
-            website=row[2].strip() if len(row) > 2 else "",
-            keyword=row[3].strip() if len(row) > 3 else "",
-            nome_proprietario=row[4].strip() if len(row) > 4 else "",
-            location=row[5].strip() if len(row) > 5 else "",
-            row_number=idx + 1,  # 1-based per l'utente
-        )
+    if not kept:
+        return []
+
+    # Lettura per colonne: le 6 colonne standard vengono trasposte e ripulite
+    # con un map(str.strip) ciascuna invece di una strip per cella riga per riga
+    row_numbers, rows = zip(*kept)
+    columns = [map(str.strip, column) for column in islice(zip(*rows), 6)]
 
-        # Aggiungi colonne extra come extra_data
-        if len(row) > 6:
-            for i, header in enumerate(headers[6:], start=6):
-                if i < len(row) and header:
-                    recipient.extra_data[header] = row[i]
+    recipients: List[RecipientData] = []
+    for row_number, row, email, phone, website, keyword, nome_proprietario, location in zip(
+        row_numbers, rows, *columns
+    ):
+        if not _EMAIL_RE.match(email):
+            continue
 
-        recipients.append(recipient)
+        recipients.append(
+            RecipientData(
+                email=email,
+                phone=phone,
+                website=website,
+                keyword=keyword,
+                nome_proprietario=nome_proprietario,
+                location=location,
+                row_number=row_number,  # 1-based come nel foglio
+                # Colonne extra (oltre le 6 standard) come extra_data
+                extra_data={h: v for h, v in zip(extra_headers, row[6:]) if h},
+            )
+        )
 
     return recipients
 
 
-def load_template(template_path: str) -> Template:
-    """Carica il template Jinja2 dal file."""
+def dedupe_recipients(recipients: List[RecipientData]) -> List[RecipientData]:
+    """
+    Rimuove gli indirizzi ripetuti (senza distinzione maiuscole/minuscole).
+
+    Resta la prima riga; le altre finiscono in duplicate_rows così vengono
+    marcate come inviate insieme a lei e non ricontattate al prossimo giro.
+    """
+    unique: Dict[str, RecipientData] = {}
+    for recipient in recipients:
+        kept = unique.setdefault(recipient.email.lower(), recipient)
+        if kept is not recipient:
+            kept.duplicate_rows.append(recipient.row_number)
+    return list(unique.values())
+
+
+def load_template(template_path: str, cache_dir: str = DEFAULT_JINJA_CACHE_DIR) -> Template:
+    """Carica il template Jinja2 dal file (bytecode compilato in cache su disco)."""
     path = Path(template_path)
     if not path.exists():
         raise FileNotFoundError(f"Template non trovato: {template_path}")
@@ -248,18 +496,93 @@ def load_template(template_path: str) -> Template:
     # Usa FileSystemLoader per permettere include/extends
     template_dir = path.parent
     template_file = path.name
-    env = Environment(loader=FileSystemLoader(str(template_dir)))
+    env = _ENV_CACHE.get(template_dir)
+    if env is None:
+        # Environment riusato: i template compilati restano nella sua cache interna
+        bytecode_dir = os.path.expanduser(cache_dir)
+        os.makedirs(bytecode_dir, exist_ok=True)
+        env = Environment(
+            loader=FileSystemLoader(str(template_dir)),
+            auto_reload=False,
+            cache_size=400,
+            bytecode_cache=FileSystemBytecodeCache(directory=bytecode_dir),
+        )
+        _ENV_CACHE[template_dir] = env
     return env.get_template(template_file)
 
 
-def render_email(template: Template, subject_template: str, recipient: RecipientData) -> Tuple[str, str]:
-    """Renderizza il template con i dati del destinatario."""
+def compile_subject(environment: Environment, subject: str) -> Callable[..., str]:
+    """
+    Prepara una sola volta la funzione che produce l'oggetto di ogni email.
+
+    Un oggetto senza segnaposto Jinja2 viene restituito così com'è,
+    senza passare dal template per ogni destinatario. I segnaposto nel vecchio
+    formato str.format ({keyword}) vengono convertiti in {{ keyword }}.
+    """
+    if not _PLACEHOLDER_RE.search(subject) and ("{" in subject or "}" in subject):
+        leftover = _FORMAT_FIELD_RE.sub("", subject)
+        if "{" in leftover or "}" in leftover:
+            raise ValueError(
+                f"Oggetto non valido: {subject!r}. Usa i segnaposto Jinja2, ad esempio {{{{ keyword }}}}."
+            )
+        converted = _FORMAT_FIELD_RE.sub(r"{{ \1 }}", subject)
+        logger.warning(f"Oggetto nel vecchio formato {{campo}}: convertito in {converted!r}, usa {{{{ campo }}}}.")
+        subject = converted
+    if _PLACEHOLDER_RE.search(subject):
+        return environment.from_string(subject).render
+    return lambda **_: subject
+
+
+def render_email(
+    template: Template, subject_render: Callable[..., str], recipient: RecipientData
+) -> Tuple[str, str]:
+    """Renderizza corpo e oggetto (entrambi già compilati) con i dati del destinatario."""
     context = recipient.to_dict()
     body = template.render(**context)
-    subject = subject_template.format(**context) if "{" in subject_template else subject_template
+    subject = subject_render(**context)
     return subject, body
 
 
+def prerender_all(
+    template: Template, subject_render: Callable[..., str], recipients: List[RecipientData]
+) -> List[RenderedEmail]:
+    """
+    Renderizza tutte le email prima dell'invio.
+
+    Il lavoro CPU (Jinja) resta fuori dal ciclo SMTP, che fa solo I/O.
+    I destinatari con errori di rendering vengono segnalati e scartati.
+    """
+    rendered: List[RenderedEmail] = []
+    for recipient in recipients:
+        try:
+            subject, body = render_email(template, subject_render, recipient)
+        except Exception as e:
+            logger.warning(f"✗ Errore nell'elaborazione di {recipient.email}: {e}")
+            continue
+        rendered.append(RenderedEmail(recipient, subject, body))
+    return rendered
+
+
+def group_identical(rendered: List[RenderedEmail], rcpt_batch: int) -> List[RenderedEmail]:
+    """
+    Raggruppa le email con oggetto e corpo identici in messaggi multi-destinatario.
+
+    Ogni gruppo ha al massimo rcpt_batch destinatari: il primo resta in
+    recipient, gli altri finiscono in bcc. Le email uniche restano singole.
+    """
+    groups: Dict[Tuple[str, str], List[RenderedEmail]] = {}
+    for message in rendered:
+        groups.setdefault((message.subject, message.body), []).append(message)
+
+    grouped: List[RenderedEmail] = []
+    for messages in groups.values():
+        for start in range(0, len(messages), rcpt_batch):
+            first, *others = messages[start:start + rcpt_batch]
+            first.bcc = [m.recipient for m in others]
+            grouped.append(first)
+    return grouped
+
+
 def get_gmail_credentials() -> Tuple[str, str]:
     """Ottiene le credenziali Gmail da args o env."""
     email = os.getenv("GMAIL_EMAIL")
@@ -267,78 +590,298 @@ def get_gmail_credentials() -> Tuple[str, str]:
     return email, password
 
 
+def connect_smtp(server: smtplib.SMTP, config: SmtpConfig) -> None:
+    """(Ri)apre la connessione SMTP sullo stesso oggetto ed esegue TLS + login."""
+    server.connect(config.host, config.port)
+    # EHLO esplicito: dopo una disconnessione smtplib conserva la vecchia risposta EHLO
+    server.ehlo()
+    if not config.use_ssl:
+        # Porta 587: TLS negoziato con STARTTLS (un round-trip in più)
+        server.starttls(context=ssl.create_default_context())
+        server.ehlo()
+    server.login(config.email, config.password)
+
+
+@contextmanager
+def open_smtp(config: SmtpConfig) -> Iterator[smtplib.SMTP]:
+    """
+    Apre una sessione SMTP autenticata da riusare per più invii.
+
+    Un solo handshake TCP/TLS e un solo AUTH per ogni blocco di messaggi,
+    invece di uno per destinatario.
+    """
+    for attempt in range(SMTP_CONNECT_ATTEMPTS):
+        if config.use_ssl:
+            # TLS implicito (porta 465): handshake TLS insieme alla connessione TCP
+            server = smtplib.SMTP_SSL(timeout=30, context=ssl.create_default_context())
+        else:
+            server = smtplib.SMTP(timeout=30)
+        try:
+            connect_smtp(server, config)
+            break
+        except smtplib.SMTPAuthenticationError:
+            # Credenziali sbagliate: riprovare non serve
+            server.close()
+            raise
+        except (OSError, smtplib.SMTPException) as e:
+            # Errore temporaneo (connessione rifiutata, timeout, 421...): backoff e nuovo tentativo
+            server.close()
+            if attempt == SMTP_CONNECT_ATTEMPTS - 1:
+                raise
+            delay = 2 ** attempt
+            logger.warning(f"Connessione SMTP non riuscita ({e}), nuovo tentativo tra {delay}s...")
+            time.sleep(delay)
+    try:
+        yield server
+    finally:
+        try:
+            server.quit()
+        except smtplib.SMTPException:
+            server.close()
+
+
 def send_email(
-    gmail_email: str,
-    gmail_password: str,
+    server: Optional[smtplib.SMTP],
+    config: SmtpConfig,
     sender_name: str,
     recipient_email: str,
     subject: str,
     body: str,
     dry_run: bool = False,
-) -> bool:
+    is_html: Optional[bool] = None,
+    bcc: Tuple[str, ...] = (),
+) -> List[str]:
     """
-    Invia un'email via Gmail SMTP.
+    Invia un'email sulla sessione SMTP già aperta (vedi open_smtp).
+
+    Se is_html è None il tipo del corpo viene dedotto cercando tag HTML.
+    Con bcc il messaggio parte in un'unica transazione verso tutti gli indirizzi,
+    senza mostrarli nell'header To. Restituisce gli indirizzi accettati dal
+    server (lista vuota in caso di errore).
     
     Nota: richiede App Password, non la password normale di Gmail.
     Per creare App Password: Google Account > Sicurezza > Verifica in due passaggi > Password app.
     """
     if dry_run:
-        print(f"\n{'='*60}")
-        print(f"DRY RUN - Email NON inviata")
-        print(f"{'='*60}")
-        print(f"A: {recipient_email}")
-        print(f"Oggetto: {subject}")
-        print(f"\nCorpo:\n{body}")
-        print(f"{'='*60}\n")
-        return True
+        logger.info(
+            "\n".join(
+                [
+                    f"\n{'='*60}",
+                    "DRY RUN - Email NON inviata",
+                    "=" * 60,
+                    f"A: {recipient_email}",
+                    *([f"Ccn: {', '.join(bcc)}"] if bcc else []),
+                    f"Oggetto: {subject}",
+                    f"\nCorpo:\n{body}",
+                    f"{'='*60}\n",
+                ]
+            )
+        )
+        return [recipient_email, *bcc]
 
     try:
-        # Crea il messaggio
-        msg = MIMEMultipart("alternative")
-        msg["From"] = f"{sender_name} <{gmail_email}>"
-        msg["To"] = recipient_email
+        # Crea il messaggio: una sola parte (HTML o testo), niente contenitore multipart
+        if is_html is None:
+            is_html = bool(_HTML_RE.search(body))
+        msg = MIMEText(body, "html" if is_html else "plain", "utf-8")
+        msg["From"] = f"{sender_name} <{config.email}>"
+        # Invio di gruppo: nessun destinatario vede gli indirizzi degli altri
+        msg["To"] = "undisclosed-recipients:;" if bcc else recipient_email
         msg["Subject"] = subject
+        to_addrs = [recipient_email, *bcc]
 
-        # Aggiungi il corpo (testo semplice)
-        # Se il body contiene HTML, potresti voler usare MIMEText con 'html'
-        is_html = "<html" in body.lower() or "<body" in body.lower() or "<p>" in body.lower()
-        msg.attach(MIMEText(body, "html" if is_html else "plain", "utf-8"))
+        # Invia sulla connessione persistente
+        try:
+            refused = server.send_message(msg, to_addrs=to_addrs)
+        except smtplib.SMTPServerDisconnected:
+            # Connessione caduta (timeout lato server): riconnetti e riprova una volta
+            logger.warning("Connessione SMTP persa, riconnessione in corso...")
+            connect_smtp(server, config)
+            refused = server.send_message(msg, to_addrs=to_addrs)
 
-        # Invia via SMTP
-        with smtplib.SMTP("smtp.gmail.com", 587) as server:
-            server.starttls()
-            server.login(gmail_email, gmail_password)
-            server.send_message(msg)
+        # Resetta lo stato della transazione lato server prima del prossimo destinatario
+        try:
+            server.rset()
+        except smtplib.SMTPServerDisconnected:
+            pass  # Verrà riaperta al prossimo invio
 
-        return True
+        for address, (code, reply) in refused.items():
+            logger.warning(f"Destinatario rifiutato {address}: {code} {reply!r}")
+        return [address for address in to_addrs if address not in refused]
     except smtplib.SMTPAuthenticationError:
-        print(f"ERRORE: Autenticazione Gmail fallita. Verifica email e App Password.")
-        return False
+        logger.error("ERRORE: Autenticazione Gmail fallita. Verifica email e App Password.")
+        return []
     except Exception as e:
-        print(f"ERRORE nell'invio a {recipient_email}: {e}")
-        return False
+        logger.error(f"ERRORE nell'invio a {recipient_email}: {e}")
+        return []
+
 
+def resolve_sent_column(ws, sent_column: str = "Inviata") -> Optional[int]:
+    """
+    Restituisce l'indice (1-based) della colonna 'Inviata', creandola se non esiste.
 
-def mark_as_sent(ws, row_number: int, sent_column: str = "Inviata"):
-    """Marca una riga come inviata nel Google Sheet (cambia 'no' -> 'sì')."""
+    Chiamata una sola volta per esecuzione: mark_as_sent riusa il risultato.
+    """
     try:
         headers = ws.row_values(1)
-        if sent_column not in headers:
-            # Aggiungi la colonna se non esiste
-            col_letter = chr(ord("A") + len(headers))
-            ws.update(values=[[sent_column]], range_name=f"{col_letter}1")
-            headers.append(sent_column)
-
-        col_idx = headers.index(sent_column)
-        col_letter = chr(ord("A") + col_idx)
-        ws.update(values=[["sì"]], range_name=f"{col_letter}{row_number}")
+        if sent_column in headers:
+            return headers.index(sent_column) + 1
+
+        # Aggiungi la colonna se non esiste (allargando la griglia se è piena)
+        col = len(headers) + 1
+        if col > ws.col_count:
+            ws.add_cols(col - ws.col_count)
+        ws.update(values=[[sent_column]], range_name=rowcol_to_a1(1, col))
+        return col
     except Exception as e:
-        print(f"Avviso: impossibile marcare riga {row_number} come inviata: {e}")
+        logger.warning(f"Avviso: impossibile trovare la colonna '{sent_column}': {e}")
+        return None
+
+
+def mark_as_sent(ws, row_number: int, sent_col: int) -> None:
+    """
+    Marca una riga come inviata (cambia 'no' -> 'sì').
+
+    Le scritture vengono accumulate e inviate a Google Sheets in un'unica
+    batch_update ogni MARK_FLUSH_EVERY righe (vedi flush_marks).
+    """
+    with _marks_lock:
+        _pending_marks.append({"range": rowcol_to_a1(row_number, sent_col), "values": [["sì"]]})
+        should_flush = len(_pending_marks) >= _next_flush_at
+    if should_flush:
+        flush_marks(ws)
+
+
+def flush_marks(ws) -> bool:
+    """
+    Scrive su Google Sheets tutte le marcature 'sì' ancora in sospeso.
+
+    Gli errori temporanei (rete, 429, 5xx) vengono ritentati con backoff; se la
+    scrittura non riesce le marcature tornano in coda, così il flush successivo
+    le riprova. Ritorna False se restano marcature non scritte.
+    """
+    global _next_flush_at
+    with _marks_lock:
+        if not _pending_marks:
+            return True
+        marks = list(_pending_marks)
+        _pending_marks.clear()
+    for attempt in range(MARK_FLUSH_ATTEMPTS):
+        try:
+            # Una sola values.batchUpdate (API v4) per tutte le celle in sospeso
+            ws.spreadsheet.values_batch_update(
+                {
+                    "valueInputOption": "USER_ENTERED",
+                    "data": [
+                        {"range": absolute_range_name(ws.title, m["range"]), "values": m["values"]}
+                        for m in marks
+                    ],
+                }
+            )
+            with _marks_lock:
+                _next_flush_at = len(_pending_marks) + MARK_FLUSH_EVERY
+            return True
+        except (APIError, OSError) as e:
+            retryable = not isinstance(e, APIError) or e.code in _RETRYABLE_SHEETS_STATUS
+            if not retryable or attempt == MARK_FLUSH_ATTEMPTS - 1:
+                error = e
+                break
+            time.sleep(2 ** attempt)
+        except Exception as e:
+            error = e
+            break
+    # Rimesse in testa alla coda: senza marcatura verrebbero rinviate al prossimo --skip-sent
+    with _marks_lock:
+        _pending_marks[:0] = marks
+        # Niente nuovo tentativo a ogni email: il prossimo flush dopo altre MARK_FLUSH_EVERY marcature
+        # (o quello finale in main)
+        _next_flush_at = len(_pending_marks) + MARK_FLUSH_EVERY
+    logger.warning(f"Avviso: impossibile marcare come inviate {len(marks)} celle, riproverò più avanti: {error}")
+    return False
+
+
+def send_worker(
+    jobs: List[Tuple[int, RenderedEmail]],
+    total: int,
+    is_html: Optional[bool],
+    smtp_config: SmtpConfig,
+    args: argparse.Namespace,
+    ws,
+    sent_col: Optional[int],
+    rate_limiter: Optional[RateLimiter],
+    stats: SendStats,
+) -> None:
+    """
+    Invia una partizione dei destinatari (eseguita in un thread del pool).
+
+    Ogni worker usa connessioni SMTP proprie, riaperte ogni
+    --emails-per-connection messaggi. Gli esiti finiscono in stats, contati
+    per destinatario anche per i messaggi con più indirizzi in Ccn.
+    """
+    pending = iter(jobs)
+
+    while batch := list(islice(pending, args.emails_per_connection)):
+        with ExitStack() as stack:
+            server = None
+            if not args.dry_run:
+                try:
+                    server = stack.enter_context(open_smtp(smtp_config))
+                except smtplib.SMTPAuthenticationError:
+                    raise
+                except (OSError, smtplib.SMTPException) as e:
+                    # Server irraggiungibile anche dopo i tentativi: il blocco conta come errori,
+                    # il worker passa al blocco successivo invece di fermarsi
+                    failed = sum(1 + len(message.bcc) for _, message in batch)
+                    logger.error(f"ERRORE: connessione SMTP non riuscita ({e}), {failed} destinatari non inviati")
+                    for _ in range(failed):
+                        stats.record(False)
+                    continue
+            for i, message in batch:
+                recipients = [message.recipient, *message.bcc]
+                logger.debug(f"[{i}/{total}] Elaborazione: {', '.join(r.email for r in recipients)}")
+
+                if rate_limiter:
+                    rate_limiter.wait()
+                # Soglia di errori superata da un altro worker o Ctrl+C: fermati prima di inviare
+                stats.check()
+                try:
+                    delivered = set(
+                        send_email(
+                            server,
+                            smtp_config,
+                            args.sender_name,
+                            message.recipient.email,
+                            message.subject,
+                            message.body,
+                            dry_run=args.dry_run,
+                            is_html=is_html,
+                            bcc=tuple(r.email for r in message.bcc),
+                        )
+                    )
+
+                    # Marca solo gli indirizzi accettati dal server (250 su RCPT TO)
+                    outcomes = [recipient.email in delivered for recipient in recipients]
+                    for recipient, ok in zip(recipients, outcomes):
+                        if ok:
+                            if sent_col:
+                                for row_number in (recipient.row_number, *recipient.duplicate_rows):
+                                    mark_as_sent(ws, row_number, sent_col)
+                            logger.debug(f"✓ Email inviata con successo a {recipient.email}")
+                        else:
+                            logger.warning(f"✗ Errore nell'invio a {recipient.email}")
+
+                except Exception as e:
+                    outcomes = [False] * len(recipients)
+                    logger.warning(f"✗ Errore nell'elaborazione di {message.recipient.email}: {e}")
+
+                for ok in outcomes:
+                    stats.record(ok)
 
 
 def main():
     """Funzione principale."""
     args = parse_args()
+    setup_logging(verbose=args.verbose, quiet=args.quiet)
 
     # Carica credenziali Gmail
     gmail_email = args.gmail_email or os.getenv("GMAIL_EMAIL")
@@ -350,17 +893,29 @@ def main():
             "o setta GMAIL_EMAIL e GMAIL_APP_PASSWORD come variabili d'ambiente."
         )
 
+    if args.emails_per_connection < 1:
+        raise ValueError("--emails-per-connection deve essere >= 1")
+    if args.concurrency < 1:
+        raise ValueError("--concurrency deve essere >= 1")
+    if args.rate_per_minute is not None and args.rate_per_minute < 1:
+        raise ValueError("--rate-per-minute deve essere >= 1")
+    if args.rcpt_batch < 1:
+        raise ValueError("--rcpt-batch deve essere >= 1")
+    if not 0 < args.abort_failure_ratio <= 1:
+        raise ValueError("--abort-failure-ratio deve essere tra 0 (escluso) e 1")
+
     # Carica template
-    print(f"Caricamento template da: {args.template}")
-    template = load_template(args.template)
+    logger.info(f"Caricamento template da: {args.template}")
+    template = load_template(args.template, args.jinja_cache_dir)
+    subject_render = compile_subject(template.environment, args.subject)
 
     # Connetti a Google Sheets
-    print(f"Connessione a Google Sheets (ID: {args.sheet_id})...")
+    logger.info(f"Connessione a Google Sheets (ID: {args.sheet_id})...")
     client = build_gspread_client(args.service_account, args.service_account_json)
     ws = get_worksheet(client, args.sheet_id, args.worksheet)
 
     # Carica destinatari
-    print("Caricamento destinatari dal foglio...")
+    logger.info("Caricamento destinatari dal foglio...")
     recipients = load_recipients(
         ws,
         start_row=args.start_row,
@@ -370,58 +925,115 @@ def main():
     )
 
     if not recipients:
-        print("Nessun destinatario trovato.")
+        logger.info("Nessun destinatario trovato.")
         return
 
-    print(f"Trovati {len(recipients)} destinatari.")
+    unique_recipients = dedupe_recipients(recipients)
+    if len(unique_recipients) < len(recipients):
+        logger.info(f"Rimossi {len(recipients) - len(unique_recipients)} indirizzi duplicati.")
+    recipients = unique_recipients
 
-    # Invia email
-    success_count = 0
-    error_count = 0
+    logger.info(f"Trovati {len(recipients)} destinatari.")
 
-    for i, recipient in enumerate(recipients, 1):
-        print(f"\n[{i}/{len(recipients)}] Elaborazione: {recipient.email}")
+    # Colonna "Inviata" risolta una sola volta per tutta l'esecuzione
+    sent_col = None
+    if not args.dry_run and args.mark_sent_column:
+        sent_col = resolve_sent_column(ws, args.mark_sent_column)
 
-        try:
-            # Renderizza template
-            subject, body = render_email(template, args.subject, recipient)
-
-            # Invia email
-            success = send_email(
-                gmail_email or "test@example.com",
-                gmail_password or "dummy",
-                args.sender_name,
-                recipient.email,
-                subject,
-                body,
-                dry_run=args.dry_run,
-            )
+    # Renderizza tutto prima di aprire le connessioni SMTP
+    rendered = prerender_all(template, subject_render, recipients)
+    render_errors = len(recipients) - len(rendered)
+    if args.rcpt_batch > 1:
+        # Corpi identici: un solo messaggio con più RCPT TO invece di N transazioni
+        rendered = group_identical(rendered, args.rcpt_batch)
+    # Template .html: corpo sicuramente HTML, nessuna scansione per messaggio
+    is_html = True if args.template.lower().endswith((".html", ".htm")) else None
 
-            if success:
-                success_count += 1
-                if not args.dry_run and args.mark_sent_column:
-                    mark_as_sent(ws, recipient.row_number, args.mark_sent_column)
-                print(f"✓ Email inviata con successo a {recipient.email}")
-            else:
-                error_count += 1
-                print(f"✗ Errore nell'invio a {recipient.email}")
+    # Invia email: --concurrency thread, ognuno con le proprie sessioni SMTP
+    stats = SendStats(args.abort_failure_ratio, args.abort_min_batch)
+    smtp_config = SmtpConfig(
+        gmail_email or "test@example.com",
+        gmail_password or "dummy",
+        host=args.smtp_host,
+        port=args.smtp_port or (465 if args.smtp_ssl else 587),
+        use_ssl=args.smtp_ssl,
+    )
+    # Un solo limitatore condiviso dai thread: --delay diventa "un invio ogni delay secondi" in totale
+    if args.rate_per_minute:
+        rate_limiter = RateLimiter(args.rate_per_minute)
+    elif args.delay > 0:
+        rate_limiter = RateLimiter(1, period=args.delay)
+    else:
+        rate_limiter = None
+    jobs = list(enumerate(rendered, 1))
+    # In dry-run un solo worker, altrimenti le anteprime stampate si mescolano
+    workers = 1 if args.dry_run else max(1, min(args.concurrency, len(jobs)))
 
-        except Exception as e:
-            error_count += 1
-            print(f"✗ Errore nell'elaborazione di {recipient.email}: {e}")
+    # Niente "with": all'uscita aspetterebbe la fine di ogni partizione anche dopo un Ctrl+C
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = [
+            executor.submit(
+                send_worker,
+                jobs[k::workers],  # Partizione round-robin
+                len(jobs),
+                is_html,
+                smtp_config,
+                args,
+                ws,
+                sent_col,
+                rate_limiter,
+                stats,
+            )
+            for k in range(workers)
+        ]
+        # Attesa a intervalli brevi: su Windows un'attesa senza timeout non si interrompe con Ctrl+C
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=0.5, return_when=FIRST_EXCEPTION)
+            for future in done:
+                future.result()
+    except KeyboardInterrupt:
+        # I worker si fermano prima del prossimo invio; le email già partite vengono marcate (finally)
+        stats.stop()
+        logger.warning("Interruzione richiesta (Ctrl+C): attendo la fine degli invii in corso...")
+    except EmailAgentAbort as e:
+        # Le marcature delle email già partite vengono comunque scritte (finally)
+        logger.error(f"ERRORE: invio interrotto, {e}. Controlla credenziali e limiti del provider.")
+    except smtplib.SMTPAuthenticationError:
+        stats.stop()  # Gli altri worker userebbero le stesse credenziali
+        logger.error("ERRORE: Autenticazione Gmail fallita. Verifica email e App Password.")
+        return
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        if not flush_marks(ws):
+            with _marks_lock:
+                unmarked = [m["range"] for m in _pending_marks]
+            logger.error(
+                f"ERRORE: {len(unmarked)} celle di email inviate non marcate come '{args.mark_sent_column}' "
+                f"({', '.join(unmarked)}): segnale a mano prima di rilanciare con --skip-sent."
+            )
 
-        # Delay tra email
-        if i < len(recipients) and args.delay > 0:
-            time.sleep(args.delay)
+    error_count = render_errors + stats.errors
+    not_attempted = len(recipients) - stats.success - error_count
 
     # Riepilogo
-    print(f"\n{'='*60}")
-    print(f"RIEPILOGO")
-    print(f"{'='*60}")
-    print(f"Email inviate con successo: {success_count}")
-    print(f"Errori: {error_count}")
-    print(f"Totale: {len(recipients)}")
-    print(f"{'='*60}")
+    logger.info(
+        "\n".join(
+            [
+                f"\n{'='*60}",
+                "RIEPILOGO",
+                "=" * 60,
+                f"Email inviate con successo: {stats.success}",
+                f"Errori: {error_count}",
+                *([f"Non tentate (invio interrotto): {not_attempted}"] if stats.aborted or stats.interrupted else []),
+                f"Totale: {len(recipients)}",
+                "=" * 60,
+            ]
+        )
+    )
+    if stats.interrupted:
+        sys.exit(130)  # Codice di uscita convenzionale per SIGINT
 
 
 if __name__ == "__main__":
@@ -1,16 +1,19 @@
 import argparse
 import asyncio
+import hashlib
 import json
 import os
 import random
 import re
 import sys
 import time
-from dataclasses import dataclass
-from datetime import datetime, timezone
+from concurrent.futures import Executor, ProcessPoolExecutor
+from contextlib import AsyncExitStack
+from dataclasses import dataclass, fields
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Sequence, Tuple
-from urllib.parse import quote_plus, unquote, urljoin, urlparse
+from typing import Any, Awaitable, BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+from urllib.parse import parse_qsl, quote_plus, unquote, urlencode, urljoin, urlparse
 
 
 def log(message: str, level: str = "INFO") -> None:
@@ -27,8 +30,19 @@ def log(message: str, level: str = "INFO") -> None:
 
 import gspread
 import httpx
-from bs4 import BeautifulSoup
-from playwright.async_api import Browser, Page, async_playwright
+from gspread.exceptions import APIError
+from lxml import etree
+from playwright.async_api import Browser, BrowserContext, Page, Route, async_playwright
+
+try:
+    import orjson  # Serializzazione JSON in C, molto più veloce del modulo json
+except ImportError:  # orjson è opzionale: fallback sulla libreria standard
+    orjson = None
+
+try:
+    import ijson  # Parsing incrementale dei file .json grandi, senza caricarli tutti in memoria
+except ImportError:  # opzionale: senza ijson il file .json viene letto per intero
+    ijson = None
 
 
 DEFAULT_QUERIES = [
@@ -49,10 +63,99 @@ HEADERS = {
     )
 }
 
-EMAIL_REGEX = re.compile(r"[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}", re.IGNORECASE)
+# Client HTTP condiviso per l'analisi dei siti: connessioni riusate (keep-alive) e
+# HTTP/2, così le pagine candidate dello stesso sito viaggiano su una sola connessione
+HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=50, keepalive_expiry=30)
+HTTP_TIMEOUT = httpx.Timeout(8.0, connect=3.0)
+
+# Stati HTTP di Google Sheets per cui ha senso ritentare la scrittura
+RETRYABLE_SHEETS_STATUS = frozenset({429, 500, 502, 503, 504})
+
+# Risorse inutili per leggere i risultati di Maps: bloccate per caricare più in fretta
+BLOCKED_RESOURCE_TYPES = frozenset({"image", "media", "font"})
+BLOCKED_HOSTS = ("googletagmanager", "doubleclick", "google-analytics")
+
+# Il lookbehind fa partire il tentativo solo all'inizio di una parola: senza, il
+# motore riprova la parte locale da ogni carattere interno (scansione quadratica)
+EMAIL_REGEX = re.compile(r"(?<![A-Za-z0-9._%+-])[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}", re.IGNORECASE)
+
+# Pattern per rating, recensioni e città, compilati una volta sola
+_NUMBER_RE = re.compile(r"[\d.,]+")
+_DIGITS_RE = re.compile(r"\d+")
+# Icone di Maps nel testo (es. U+E0C8): caratteri della Private Use Area da scartare
+_PUA_TABLE = dict.fromkeys(range(0xE000, 0xF900))
+_CAP_CITY_PROV_RE = re.compile(r"\b\d{5}\s+([A-ZÀ-Ö][a-zà-ö]+(?:\s+[A-ZÀ-Ö][a-zà-ö]+)*)\s+[A-Z]{2}\b")
+_CITY_PROV_RE = re.compile(r",\s*([A-ZÀ-Ö][a-zà-ö]+(?:\s+[A-ZÀ-Ö][a-zà-ö]+)*)\s+[A-Z]{2}\s*$")
+
+# Pattern per assess_site_quality, compilati una volta sola
+_OLD_LIBRARY_RE = re.compile(r"(?P<jquery>jquery-?1\.)|(?P<bootstrap>bootstrap.*[23]\.|[23]\..*bootstrap)", re.IGNORECASE)
+# Cercati come sottostringhe semplici nell'HTML in minuscolo: molto più veloce di una regex IGNORECASE
+_FREE_SERVICE_DOMAINS = ("wix.com", "weebly.com", "squarespace.com")
+_MODERN_FRAMEWORK_RE = re.compile(r"react|vue|angular|next", re.IGNORECASE)
+
+# Parametri di tracciamento ignorati nel confronto tra siti (oltre a tutti gli utm_*)
+TRACKING_QUERY_PARAMS = frozenset({"gclid", "fbclid", "ref"})
+
+# Validità delle voci in --site-cache: oltre questa età il sito viene rianalizzato
+SITE_CACHE_MAX_AGE = timedelta(days=30)
+
+# Oltre questa dimensione una pagina è "pesante": non serve scaricarne il resto
+MAX_HTML_BYTES = 400_000
+
+# Casella di ricerca di Maps e marcatura della lista risultati corrente
+SEARCH_BOX_SELECTOR = "input#searchboxinput"
+MARK_OLD_FEED_JS = """() => {
+    const feed = document.querySelector("div[role='feed']");
+    if (feed) feed.dataset.scraperOld = "1";
+}"""
+
+# Legge dalla lista risultati i dati visibili di tutte le card in un solo round-trip,
+# nello stesso ordine di div[role='article'] usato per il click
+FEED_CARDS_JS = """
+() => Array.from(document.querySelectorAll("div[role='article']"), (card) => {
+    const attr = (selector, name) => {
+        const el = card.querySelector(selector);
+        return el ? (el.getAttribute(name) || "") : "";
+    };
+    // Prima riga informativa: "Categoria · Indirizzo"
+    const lines = Array.from(card.querySelectorAll(".W4Efsd .W4Efsd"), (el) => (el.innerText || "").trim());
+    const parts = (lines[0] || "").split("·").map((p) => p.trim()).filter(Boolean);
+    const phone = Array.from(card.querySelectorAll(".W4Efsd span"), (el) => (el.innerText || "").trim())
+        .find((text) => /^\\+?[\\d\\s]{6,}$/.test(text)) || "";
+    return {
+        name: card.getAttribute("aria-label") || attr("a.hfpxzc", "aria-label"),
+        category: parts[0] || "",
+        address: parts.slice(1).join(" "),
+        phone: phone,
+        website: attr("a[data-value='Sito web'], a[data-value='Website']", "href"),
+        rating: attr("span[role='img'][aria-label*='stelle']", "aria-label"),
+        reviews: "",
+    };
+})
+"""
+
+# Legge tutti i campi del pannello dettagli con un solo round-trip verso il browser
+CARD_DETAILS_JS = """
+() => {
+    const q = (selector, attr) => {
+        const el = document.querySelector(selector);
+        if (!el) return "";
+        return attr ? (el.getAttribute(attr) || "") : (el.innerText || "").trim();
+    };
+    return {
+        name: q("h1.DUwDvf"),
+        category: q("button.DkEaL"),
+        address: q("button[data-item-id*='address']"),
+        phone: q("button[data-item-id*='phone']"),
+        website: q("a[data-item-id*='authority']", "href"),
+        rating: q("span[aria-label*='stelle']", "aria-label"),
+        reviews: q("button[jsaction*='pane.rating.moreReviews']"),
+    };
+}
+"""
 
 
-@dataclass
+@dataclass(slots=True)
 class BusinessRecord:
     query: str
     business_keyword: str = ""  # solo tipologia business (es. "centro estetico", "idraulico")
@@ -85,42 +188,13 @@ class BusinessRecord:
     
     def to_dict(self) -> Dict[str, Any]:
         """Converte il record in dizionario per salvataggio JSON."""
-        return {
-            "query": self.query,
-            "business_keyword": self.business_keyword,
-            "city": self.city,
-            "name": self.name,
-            "category": self.category,
-            "address": self.address,
-            "phone": self.phone,
-            "website": self.website,
-            "email": self.email,
-            "rating": self.rating,
-            "reviews": self.reviews,
-            "migliorabile": self.migliorabile,
-            "note": self.note,
-            "timestamp": self.timestamp,
-        }
+        return {f.name: getattr(self, f.name) for f in fields(self)}
     
     @classmethod
     def from_dict(cls, data: Dict[str, Any]) -> "BusinessRecord":
-        """Crea un BusinessRecord da un dizionario."""
-        return cls(
-            query=data.get("query", ""),
-            business_keyword=data.get("business_keyword", ""),
-            city=data.get("city", ""),
-            name=data.get("name", ""),
-            category=data.get("category", ""),
-            address=data.get("address", ""),
-            phone=data.get("phone", ""),
-            website=data.get("website", ""),
-            email=data.get("email", ""),
-            rating=data.get("rating", ""),
-            reviews=data.get("reviews", ""),
-            migliorabile=data.get("migliorabile", False),
-            note=data.get("note", ""),
-            timestamp=data.get("timestamp", ""),
-        )
+        """Crea un BusinessRecord da un dizionario (chiavi mancanti: valori di default)."""
+        known = {k: v for k, v in data.items() if k in cls.__dataclass_fields__}
+        return cls(**{"query": "", **known})
 
 
 def parse_args() -> argparse.Namespace:
@@ -137,9 +211,39 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument("--min-delay", type=float, default=0.1, help="Delay minimo tra card (default: 0.1s per velocità).")
     parser.add_argument("--max-delay", type=float, default=0.3, help="Delay massimo tra card (default: 0.3s per velocità).")
     parser.add_argument("--headful", action="store_true", help="Lancia il browser visibile.")
+    parser.add_argument(
+        "--no-block-resources",
+        action="store_true",
+        help="Non bloccare immagini, font, media e tracker nel browser (più lento).",
+    )
+    parser.add_argument(
+        "--fast-cards",
+        action="store_true",
+        help="Non aprire le card che nella lista risultati mostrano già sito e telefono (più veloce, ma città della query e indirizzo senza CAP).",
+    )
+    parser.add_argument(
+        "--browser-state",
+        help="File dove salvare cookie e consenso Google a fine esecuzione, ripristinati all'avvio successivo.",
+    )
+    parser.add_argument(
+        "--browser-contexts",
+        type=int,
+        default=3,
+        help="Query Maps elaborate in parallele, ognuna in un contesto browser separato (default: 3).",
+    )
+    parser.add_argument(
+        "--parse-workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Processi per l'analisi HTML dei siti (default: numero di CPU, 0 = nel processo principale).",
+    )
     parser.add_argument("--max-concurrent", type=int, default=10, help="Numero massimo di analisi siti web in parallelo (default: 10).")
-    parser.add_argument("--save-to", help="Percorso file JSON per salvare risultati localmente (default: results_YYYYMMDD_HHMMSS.json).")
-    parser.add_argument("--load-from", help="Carica risultati da file JSON locale invece di fare scraping.")
+    parser.add_argument("--save-to", help="Percorso file per salvare risultati localmente: .jsonl viene aggiornato dopo ogni query, .json solo a fine scraping (default: results_YYYYMMDD_HHMMSS.jsonl).")
+    parser.add_argument(
+        "--site-cache",
+        help="File JSON dove ricordare l'esito dell'analisi dei siti tra un'esecuzione e l'altra (i siti già visti negli ultimi 30 giorni non vengono riscaricati).",
+    )
+    parser.add_argument("--load-from", help="Carica risultati da file .json o .jsonl locale invece di fare scraping.")
     return parser.parse_args()
 
 
@@ -187,14 +291,13 @@ def build_gspread_client(service_account_path: Optional[str], service_account_js
 def get_worksheet(client: gspread.Client, sheet_id: str, worksheet_name: str):
     sh = client.open_by_key(sheet_id)
     
-    # Lista tutti i worksheet disponibili per debug
-    all_worksheets = [w.title for w in sh.worksheets()]
-    log(f"Worksheet disponibili nel foglio: {', '.join(all_worksheets)}", "INFO")
-    
     try:
         ws = sh.worksheet(worksheet_name)
         log(f"Worksheet '{worksheet_name}' trovato", "INFO")
     except gspread.WorksheetNotFound:
+        # Lista dei worksheet esistenti solo quando serve (una chiamata API in più)
+        all_worksheets = [w.title for w in sh.worksheets()]
+        log(f"Worksheet disponibili nel foglio: {', '.join(all_worksheets)}", "INFO")
         log(f"Worksheet '{worksheet_name}' non trovato, creazione nuovo...", "WARNING")
         ws = sh.add_worksheet(title=worksheet_name, rows=1000, cols=7)
         log(f"Worksheet '{worksheet_name}' creato", "SUCCESS")
@@ -211,12 +314,14 @@ def get_worksheet(client: gspread.Client, sheet_id: str, worksheet_name: str):
 
 
 def load_existing_websites(ws) -> set:
+    """Chiavi di deduplicazione (vedi website_key) dei siti già presenti sul foglio."""
     try:
-        col = ws.col_values(3)  # Website column (1-based index)
+        # Solo la colonna Website (C), header escluso direttamente nel range
+        col = ws.get("C2:C")
     except Exception:
         return set()
-    # skip header
-    return {w.strip() for w in col[1:] if w and w.strip()}
+    keys = (website_key(row[0]) for row in col if row)
+    return {k for k in keys if k is not None}
 
 
 async def dismiss_consent(page: Page) -> None:
@@ -232,10 +337,6 @@ async def dismiss_consent(page: Page) -> None:
             btn = page.locator(sel)
             if await btn.count() > 0:
                 await btn.click()
-                try:
-                    await page.wait_for_load_state("networkidle", timeout=8000)
-                except Exception:
-                    pass
                 await page.wait_for_timeout(100)  # Ridotto da 500ms
                 return
     except Exception:
@@ -247,10 +348,6 @@ async def dismiss_consent(page: Page) -> None:
             btn = frame.locator(sel)
             if await btn.count() > 0:
                 await btn.click()
-                try:
-                    await page.wait_for_load_state("networkidle", timeout=8000)
-                except Exception:
-                    pass
                 await page.wait_for_timeout(100)  # Ridotto da 500ms
                 return
     except Exception:
@@ -265,7 +362,64 @@ async def dismiss_consent(page: Page) -> None:
         pass
 
 
+async def block_heavy_resources(route: Route) -> None:
+    """Interrompe le richieste di immagini, font, media e tracker; lascia passare il resto."""
+    request = route.request
+    if request.resource_type in BLOCKED_RESOURCE_TYPES or any(host in request.url for host in BLOCKED_HOSTS):
+        await route.abort()
+    else:
+        await route.continue_()
+
+
+async def open_browser_context(
+    browser: Browser, block_resources: bool, storage_state: Optional[str] = None
+) -> Tuple[BrowserContext, Page]:
+    """Crea un contesto browser isolato (cookie/consenso propri) con la sua pagina.
+
+    storage_state è un file salvato da un'esecuzione precedente: ripristina cookie
+    e consenso di Google, così il banner non va gestito di nuovo.
+    """
+    context = await browser.new_context(
+        user_agent=HEADERS["User-Agent"],
+        viewport={"width": 1300, "height": 900},
+        storage_state=storage_state,
+    )
+    if block_resources:
+        # Nota: con una route attiva Playwright disattiva la cache HTTP di tutto il contesto.
+        # CSS e JS di Maps vengono quindi riscaricati a ogni navigazione: il blocco di
+        # immagini e font fa risparmiare di più (--no-block-resources riattiva la cache)
+        await context.route("**/*", block_heavy_resources)
+    page = await context.new_page()
+    return context, page
+
+
+async def search_from_box(page: Page, query: str) -> bool:
+    """Nuova ricerca dalla casella di Maps già aperta, senza ricaricare la pagina.
+
+    Ritorna False se la pagina non è su Maps o la nuova lista risultati non compare.
+    """
+    if "google.com/maps" not in page.url:
+        return False
+    try:
+        # Segna la lista della ricerca precedente per riconoscere quella nuova
+        await page.evaluate(MARK_OLD_FEED_JS)
+        box = page.locator(SEARCH_BOX_SELECTOR)
+        await box.fill(query, timeout=3000)
+        await box.press("Enter")
+        await page.wait_for_selector("div[role='feed']:not([data-scraper-old])", timeout=10000)
+        await page.wait_for_selector("div[role='feed'][data-scraper-old]", state="detached", timeout=3000)
+        return True
+    except Exception as e:
+        # Se capita a ogni query, la struttura di Maps è cambiata e ogni ricerca paga i timeout
+        log(f"  Ricerca dalla casella non riuscita, ricarico la pagina: {type(e).__name__}: {e}", "WARNING")
+        return False
+
+
 async def go_to_query(page: Page, query: str) -> None:
+    # Dalla seconda query in poi la pagina è già su Maps (consenso compreso): basta la casella di ricerca
+    if await search_from_box(page, query):
+        log("  Ricerca avviata dalla casella di Maps", "SUCCESS")
+        return
     url = f"https://www.google.com/maps/search/{quote_plus(query)}?hl=it"
     log(f"  Caricamento pagina: {url}")
     await page.goto(url, wait_until="domcontentloaded")
@@ -292,33 +446,11 @@ async def ensure_results_loaded(page: Page, target: int) -> None:
         attempts += 1
 
 
-async def safe_text(page: Page, selector: str) -> str:
-    loc = page.locator(selector).first
-    try:
-        if await loc.count() == 0:
-            return ""
-        txt = await loc.inner_text()
-        return txt.strip()
-    except Exception:
-        return ""
-
-
-async def safe_attr(page: Page, selector: str, attr: str) -> str:
-    loc = page.locator(selector).first
-    try:
-        if await loc.count() == 0:
-            return ""
-        val = await loc.get_attribute(attr)
-        return val or ""
-    except Exception:
-        return ""
-
-
 def parse_rating(text: str) -> Tuple[str, str]:
     rating = ""
     reviews = ""
     if text:
-        digits = re.findall(r"[\d.,]+", text)
+        digits = _NUMBER_RE.findall(text)
         if digits:
             rating = digits[0].replace(",", ".")
         if len(digits) > 1:
@@ -329,7 +461,7 @@ def parse_rating(text: str) -> Tuple[str, str]:
 def parse_reviews(text: str) -> str:
     if not text:
         return ""
-    digits = re.findall(r"\d+", text.replace(".", ""))
+    digits = _DIGITS_RE.findall(text.replace(".", ""))
     return digits[0] if digits else ""
 
 
@@ -342,18 +474,17 @@ def extract_city_from_address(address: str) -> str:
     if not address:
         return ""
     # Rimuovi caratteri speciali come \ue0c8 (icona)
-    address = re.sub(r"\\u[0-9a-fA-F]{4}", "", address)
-    address = address.strip()
+    address = address.translate(_PUA_TABLE).strip()
     
     # Pattern: CAP (5 cifre) seguito da città e sigla provincia (2 lettere)
     # Es: "20100 Milano MI"
-    match = re.search(r"\b\d{5}\s+([A-ZÀ-Ö][a-zà-ö]+(?:\s+[A-ZÀ-Ö][a-zà-ö]+)*)\s+[A-Z]{2}\b", address)
+    match = _CAP_CITY_PROV_RE.search(address)
     if match:
         return match.group(1).strip()
     
     # Pattern: città seguita da sigla provincia alla fine
     # Es: "Via X, Milano MI"
-    match = re.search(r",\s*([A-ZÀ-Ö][a-zà-ö]+(?:\s+[A-ZÀ-Ö][a-zà-ö]+)*)\s+[A-Z]{2}\s*$", address)
+    match = _CITY_PROV_RE.search(address)
     if match:
         return match.group(1).strip()
     
@@ -372,125 +503,209 @@ def extract_city_from_address(address: str) -> str:
 
 
 def extract_emails_from_html(html: str) -> List[str]:
-    emails = set()
-    for match in re.findall(EMAIL_REGEX, html):
-        emails.add(unquote(match))
-    return sorted(emails)
+    # Niente "@" nella pagina: nessuna email possibile, evita la scansione regex
+    if "@" not in html:
+        return []
+    return sorted({unquote(match.group()) for match in EMAIL_REGEX.finditer(html)})
+
+
+# Domini tecnici (script di terze parti) che non sono email di contatto
+EMAIL_BLACKLIST_SUFFIXES = ("wixpress.com", "sentry.io")
+COMMON_EMAIL_DOMAINS = frozenset({"gmail.com", "outlook.com", "hotmail.com", "yahoo.it", "yahoo.com", "virgilio.it"})
 
 
 def choose_best_email(candidates: List[str], website: str) -> str:
+    """Preferisce un'email sul dominio del sito, poi una di provider comuni, poi la prima valida."""
     if not candidates:
         return ""
-    blacklist_domains = {"wixpress.com", "sentry-next.wixpress.com", "sentry.io"}
-
-    def domain_of(email: str) -> str:
-        parts = email.lower().split("@")
-        return parts[1] if len(parts) == 2 else ""
-
     site_domain = urlparse(website).netloc.lower() if website else ""
-    filtered: List[str] = []
+
+    # Una sola passata: ogni email finisce nel suo gruppo di priorità
+    same_domain: List[str] = []
+    common: List[str] = []
+    other: List[str] = []
     for e in candidates:
-        if not e:
-            continue
-        user = e.split("@")[0]
-        dom = domain_of(e)
-        if not dom:
+        user, _, dom = e.partition("@")
+        dom = dom.lower()
+        if not dom or "@" in dom or len(user) > 40:
             continue
-        if len(user) > 40:
+        if dom.endswith(EMAIL_BLACKLIST_SUFFIXES) or ".js" in dom or ".js" in user:
             continue
-        if dom in blacklist_domains or dom.endswith("wixpress.com") or dom.endswith("sentry.io"):
-            continue
-        if dom.endswith(".js") or ".js" in dom or ".js" in user:
-            continue
-        filtered.append(e)
-
-    if filtered:
-        same_domain = [e for e in filtered if site_domain and domain_of(e) in site_domain]
-        if same_domain:
-            return same_domain[0]
-        common = {
-            "gmail.com",
-            "outlook.com",
-            "hotmail.com",
-            "yahoo.it",
-            "yahoo.com",
-            "virgilio.it",
-        }
-        common_email = [e for e in filtered if domain_of(e) in common]
-        if common_email:
-            return common_email[0]
-        return filtered[0]
-    return ""
+        if site_domain and dom in site_domain:
+            same_domain.append(e)
+        elif dom in COMMON_EMAIL_DOMAINS:
+            common.append(e)
+        else:
+            other.append(e)
+    return (same_domain or common or other or [""])[0]
 
 
-def assess_site_quality(html: str, url: str) -> Tuple[bool, str]:
+class QualityScanner:
+    """
+    Target per il parser HTML di lxml: raccoglie i segnali di qualità mentre
+    la pagina viene letta, senza costruire l'albero DOM.
+    """
+
+    # Il testo dentro questi tag non conta come contenuto visibile
+    SKIP_TEXT_TAGS = frozenset({"script", "style", "template", "rt", "rp"})
+
+    def __init__(self) -> None:
+        self.has_viewport = self.has_description = self.has_favicon = False
+        self.has_og_tags = self.has_canonical = self.has_robots_meta = False
+        self.has_structured_data = self.has_schema_org = self.has_modern_framework = False
+        self.old_library = ""
+        self.tables = self.divs = 0
+        self.title: Optional[str] = None
+        # Lunghezza del testo visibile (stringhe ripulite unite da uno spazio)
+        self.text_length = -1
+        self._skip_depth = 0
+        self._in_title = False
+        self._script: Optional[List[str]] = None
+        self._buffer: List[str] = []
+
+    def _flush_text(self) -> None:
+        """Chiude il blocco di testo corrente (lxml può spezzarlo in più chiamate data)."""
+        if not self._buffer:
+            return
+        text = "".join(self._buffer).strip()
+        self._buffer.clear()
+        if text:
+            self.text_length += len(text) + 1
+
+    def start(self, tag: str, attrib: Dict[str, str]) -> None:
+        self._flush_text()
+        if "itemtype" in attrib:
+            self.has_structured_data = True
+        if "itemscope" in attrib:
+            self.has_schema_org = True
+        if tag in self.SKIP_TEXT_TAGS:
+            self._skip_depth += 1
+        if tag == "div":
+            self.divs += 1
+        elif tag == "table":
+            self.tables += 1
+        elif tag == "meta":
+            meta_name = attrib.get("name")
+            if meta_name == "viewport":
+                self.has_viewport = True
+            elif meta_name == "description":
+                self.has_description = True
+            elif meta_name == "robots":
+                self.has_robots_meta = True
+            if attrib.get("property", "").startswith("og:"):
+                self.has_og_tags = True
+        elif tag == "link":
+            rel = attrib.get("rel", "").split()
+            if any("icon" in value for value in rel):
+                self.has_favicon = True
+            if "canonical" in rel:
+                self.has_canonical = True
+        elif tag == "script":
+            src = attrib.get("src", "")
+            if src and not self.old_library:
+                match = _OLD_LIBRARY_RE.search(src)
+                if match:
+                    self.old_library = match.lastgroup
+            if not self.has_modern_framework:
+                # Attributi e contenuto dello script, come nel tag serializzato
+                self._script = [f'{k}="{v}"' for k, v in attrib.items()]
+        elif tag == "title" and self.title is None:
+            self._in_title = True
+            self.title = ""
+
+    def end(self, tag: str) -> None:
+        self._flush_text()
+        if tag in self.SKIP_TEXT_TAGS and self._skip_depth:
+            self._skip_depth -= 1
+        if tag == "script" and self._script is not None:
+            if _MODERN_FRAMEWORK_RE.search(" ".join(self._script)):
+                self.has_modern_framework = True
+            self._script = None
+        elif tag == "title":
+            self._in_title = False
+
+    def data(self, text: str) -> None:
+        if self._script is not None:
+            self._script.append(text)
+        if self._in_title:
+            self.title += text
+        if not self._skip_depth:
+            self._buffer.append(text)
+
+    def close(self) -> "QualityScanner":
+        self._flush_text()
+        return self
+
+
+def assess_site_quality(html: str, url: str, truncated: bool = False) -> Tuple[bool, str]:
     reasons: List[str] = []
-    soup = BeautifulSoup(html, "html.parser")
-    
+
+    # Una sola passata in streaming sull'HTML: nessun albero DOM da costruire e interrogare
+    scanner = QualityScanner()
+    parser = etree.HTMLParser(target=scanner)
+    try:
+        parser.feed(html)
+        parser.close()
+    except etree.LxmlError:
+        scanner.close()  # HTML vuoto o illeggibile: valgono i segnali raccolti finora
+    has_viewport = scanner.has_viewport
+    has_description = scanner.has_description
+    has_favicon = scanner.has_favicon
+    has_og_tags = scanner.has_og_tags
+    has_canonical = scanner.has_canonical
+    has_robots_meta = scanner.has_robots_meta
+    has_structured_data = scanner.has_structured_data
+    has_schema_org = scanner.has_schema_org
+    has_modern_framework = scanner.has_modern_framework
+    old_library = scanner.old_library
+    tables, divs = scanner.tables, scanner.divs
+    title = (scanner.title or "").strip()
+
     # Controlli base essenziali
     if not url.startswith("https://"):
         reasons.append("assenza https")
-    if not soup.find("meta", attrs={"name": "viewport"}):
+    if not has_viewport:
         reasons.append("non responsive (viewport mancante)")
-    if not soup.find("meta", attrs={"name": "description"}):
+    if not has_description:
         reasons.append("meta description mancante")
-    if not soup.find("link", rel=lambda v: v and "icon" in v):
+    if not has_favicon:
         reasons.append("favicon assente")
-    
+
     # Controlli tecnici datati
-    scripts = [s.get("src", "").lower() for s in soup.find_all("script") if s.get("src")]
-    for src in scripts:
-        if "jquery-1." in src or "jquery1." in src:
-            reasons.append("usa jquery 1.x")
-            break
-        if "bootstrap" in src and ("3." in src or "2." in src):
-            reasons.append("bootstrap datato")
-            break
-    
+    if old_library == "jquery":
+        reasons.append("usa jquery 1.x")
+    elif old_library == "bootstrap":
+        reasons.append("bootstrap datato")
+
     # Controlli struttura/layout
-    tables = len(soup.find_all("table"))
-    divs = len(soup.find_all("div"))
     if tables > 5 and divs < 30:
         reasons.append("layout a tabelle")
     
     # Controlli performance/contenuti
-    if len(html) > 400_000:
+    if truncated:
         reasons.append("pagina pesante >400KB")
-    text_content = soup.get_text(" ", strip=True)
-    if len(text_content) < 200:
+    if scanner.text_length < 200:
         reasons.append("contenuti scarsi")
     
     # Controlli aggiuntivi per problemi comuni
-    title_tag = soup.find("title")
-    if not title_tag or not title_tag.get_text(strip=True):
+    if not title:
         reasons.append("titolo mancante")
-    elif len(title_tag.get_text(strip=True)) < 10:
+    elif len(title) < 10:
         reasons.append("titolo troppo corto")
     
     # Controlla se usa servizi gratuiti comuni (spesso segno di siti amatoriali)
-    html_str = str(soup).lower()
-    if any(service in html_str for service in ["wix.com", "weebly.com", "squarespace.com"]):
+    html_lower = html.lower()
+    if any(domain in html_lower for domain in _FREE_SERVICE_DOMAINS):
         reasons.append("usa servizio gratuito")
     
-    # Indici di qualità positiva (siti ben fatti hanno questi)
-    has_modern_framework = any(
-        "react" in str(s).lower() or "vue" in str(s).lower() or "angular" in str(s).lower() or "next" in str(s).lower()
-        for s in soup.find_all("script")
+    # Conta caratteristiche positive (somma diretta dei bool, senza lista intermedia)
+    positive_indicators = (
+        has_modern_framework
+        + (has_structured_data or has_schema_org)
+        + has_og_tags
+        + has_canonical
+        + has_robots_meta
     )
-    has_structured_data = bool(soup.find_all(attrs={"itemtype": True}))
-    has_og_tags = bool(soup.find("meta", attrs={"property": re.compile("^og:")}))
-    has_canonical = bool(soup.find("link", attrs={"rel": "canonical"}))
-    has_robots_meta = bool(soup.find("meta", attrs={"name": "robots"}))
-    has_schema_org = bool(soup.find_all(attrs={"itemscope": True}))
-    
-    # Conta caratteristiche positive
-    positive_indicators = sum([
-        has_modern_framework,
-        has_structured_data or has_schema_org,
-        has_og_tags,
-        has_canonical,
-        has_robots_meta,
-    ])
     
     # FILTRO: accetta siti con problemi significativi
     # Logica semplificata: se ha >= 3 caratteristiche moderne → sito troppo buono, scarta
@@ -506,50 +721,109 @@ def assess_site_quality(html: str, url: str) -> Tuple[bool, str]:
     return migliorabile, note
 
 
-async def fetch_html(client: httpx.AsyncClient, url: str) -> Optional[str]:
+def analyze_page(html: str, url: str, truncated: bool, find_emails: bool) -> Tuple[List[str], bool, str]:
+    """
+    Analisi completa di una pagina scaricata: email candidate e qualità del sito.
+
+    Un'unica funzione per pagina, così l'HTML passa una sola volta al processo
+    di analisi e le due scansioni CPU girano entrambe fuori dal loop asyncio.
+    """
+    emails = extract_emails_from_html(html) if find_emails else []
+    migliorabile, note = assess_site_quality(html, url, truncated)
+    return emails, migliorabile, note
+
+
+async def fetch_html(client: httpx.AsyncClient, url: str) -> Optional[Tuple[str, bool]]:
+    """Scarica al massimo MAX_HTML_BYTES della pagina; restituisce (html, troncata)."""
     try:
-        resp = await client.get(url, timeout=8.0, follow_redirects=True)
-        if resp.status_code < 400 and resp.text:
-            return resp.text
+        async with client.stream("GET", url) as resp:
+            # Stato e tipo sono già negli header: per errori, PDF, immagini... il corpo non si scarica
+            if resp.status_code >= 400:
+                return None
+            content_type = resp.headers.get("content-type", "").lower()
+            if content_type and "html" not in content_type:
+                return None
+            body = bytearray()
+            truncated = False
+            async for chunk in resp.aiter_bytes():
+                body += chunk
+                if len(body) > MAX_HTML_BYTES:
+                    # Pagina pesante: il resto non cambia la valutazione
+                    truncated = True
+                    del body[MAX_HTML_BYTES:]  # L'ultimo chunk può superare il limite
+                    break
+            html = body.decode(resp.encoding or "utf-8", errors="replace")
+            if html:
+                return html, truncated
     except Exception:
         return None
     return None
 
 
 async def enrich_with_site(
-    client: httpx.AsyncClient, website: str
+    client: httpx.AsyncClient, website: str, executor: Optional[Executor] = None
 ) -> Tuple[str, bool, str]:
     if not website:
         return "", False, ""
     parsed = urlparse(website)
     if not parsed.scheme:
         website = "https://" + website
-    candidates = [website]
     base = f"{parsed.scheme}://{parsed.netloc}" if parsed.netloc else website
-    for path in ["/contatti", "/contact", "/about", "/chi-siamo"]:
-        candidates.append(urljoin(base, path))
+    # Ordine di priorità: pagine contatti (dove di solito c'è l'email), poi home e altre pagine
+    candidates = [
+        urljoin(base, "/contatti"),
+        urljoin(base, "/contact"),
+        website,
+        urljoin(base, "/about"),
+        urljoin(base, "/chi-siamo"),
+    ]
     emails: List[str] = []
     migliorabile = False
     note = ""
-    for url in candidates:
-        html = await fetch_html(client, url)
-        if not html:
-            continue
-        if not emails:
-            emails = extract_emails_from_html(html)
-            if emails:
+    # Pagine già analizzate: /contatti, /about... spesso reindirizzano alla stessa pagina
+    seen_pages: set = set()
+
+    # Tutte le pagine candidate scaricate in parallelo, ma elaborate in ordine di
+    # priorità: email e nota non dipendono da quale server risponde prima
+    tasks = [asyncio.create_task(fetch_html(client, url)) for url in candidates]
+    try:
+        for url, task in zip(candidates, tasks):
+            result = await task
+            if not result:
+                continue
+            html, truncated = result
+            # Stesso HTML (e stesso schema, che conta per il controllo https): stesso esito
+            digest = hashlib.blake2b(html.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+            page_key = (digest, url.startswith("https://"))
+            if page_key in seen_pages:
+                continue
+            seen_pages.add(page_key)
+            # Email e qualità in un solo passaggio; con il pool di processi il
+            # lavoro CPU gira fuori dal loop, che intanto continua a scaricare
+            if executor is not None:
+                page_emails, is_migliorabile, site_note = await asyncio.get_running_loop().run_in_executor(
+                    executor, analyze_page, html, url, truncated, not emails
+                )
+            else:
+                page_emails, is_migliorabile, site_note = analyze_page(html, url, truncated, not emails)
+            if page_emails and not emails:
+                emails = page_emails
                 log(f"        Email candidate trovate: {len(emails)}")
-        # Valuta qualità sito - se trova un sito migliorabile, mantienilo
-        is_migliorabile, site_note = assess_site_quality(html, url)
-        if is_migliorabile:
-            migliorabile = True
-            note = site_note
-        elif not migliorabile:
-            # Se non abbiamo ancora trovato un sito migliorabile, aggiorna comunque la nota
-            note = site_note
-        # Se abbiamo email e sito migliorabile, possiamo fermarci
-        if emails and migliorabile:
-            break
+            # Valuta qualità sito - se trova un sito migliorabile, mantienilo
+            if is_migliorabile:
+                migliorabile = True
+                note = site_note
+            elif not migliorabile:
+                # Se non abbiamo ancora trovato un sito migliorabile, aggiorna comunque la nota
+                note = site_note
+            # Se abbiamo email e sito migliorabile, possiamo fermarci
+            if emails and migliorabile:
+                break
+    finally:
+        # Annulla i download ancora in corso e attendi che liberino le connessioni
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
     email = choose_best_email(emails, website)
     return email, migliorabile, note
 
@@ -565,12 +839,12 @@ async def scrape_card_basic(
     city: str,
     delay_range: Tuple[float, float],
 ) -> Optional[Dict[str, Any]]:
-    """Estrae i dati base dalla card (senza analisi sito web)."""
-    cards = page.locator("div[role='article']")
-    count = await cards.count()
-    if idx >= count:
-        return None
-    card = cards.nth(idx)
+    """Estrae i dati base dalla card (senza analisi sito web).
+
+    idx deve essere minore del numero di card già contato da scrape_query:
+    niente count() qui, che costerebbe un round-trip col browser per ogni card.
+    """
+    card = page.locator("div[role='article']").nth(idx)
     try:
         await card.scroll_into_view_if_needed()
         await card.click()
@@ -579,31 +853,44 @@ async def scrape_card_basic(
         log(f"      Errore click card {idx + 1}: {e}", "ERROR")
         return None
     
-    name = await safe_text(page, "h1.DUwDvf")
-    category = await safe_text(page, "button.DkEaL")
-    address = await safe_text(page, "button[data-item-id*='address']")
-    phone = await safe_text(page, "button[data-item-id*='phone']")
-    website = await safe_attr(page, "a[data-item-id*='authority']", "href")
-    rating_text = await safe_attr(page, "span[aria-label*='stelle']", "aria-label")
-    rating, _ = parse_rating(rating_text)
-    reviews_text = await safe_text(page, "button[jsaction*='pane.rating.moreReviews']")
-    reviews = parse_reviews(reviews_text)
-    
-    extracted_city = extract_city_from_address(address)
-    actual_city = extracted_city if extracted_city else city
+    try:
+        details = await page.evaluate(CARD_DETAILS_JS)
+    except Exception as e:
+        log(f"      Errore lettura dettagli card {idx + 1}: {e}", "ERROR")
+        return None
     
     # Delay rimosso per velocità - usa solo delay_range se necessario per evitare rate limiting
     # await page.wait_for_timeout(int(delay * 1000))
     
+    return build_card_data(details, query_str, business_keyword, city)
+
+
+def build_card_data(
+    details: Dict[str, str],
+    query_str: str,
+    business_keyword: str,
+    city: str,
+    city_from_address: bool = True,
+) -> Dict[str, Any]:
+    """Dati base della card a partire dai campi letti dal pannello dettagli o dalla lista risultati."""
+    address = details["address"]
+    rating, rating_reviews = parse_rating(details["rating"])
+    # Nella lista l'etichetta delle stelle contiene anche il numero di recensioni
+    reviews = parse_reviews(details["reviews"]) or parse_reviews(rating_reviews)
+    
+    # L'indirizzo della lista non ha CAP e provincia: lì vale la città della query
+    extracted_city = extract_city_from_address(address) if city_from_address else ""
+    actual_city = extracted_city if extracted_city else city
+    
     return {
         "query": query_str,
         "business_keyword": business_keyword,
         "city": actual_city,
-        "name": name,
-        "category": category,
+        "name": details["name"],
+        "category": details["category"],
         "address": address,
-        "phone": phone,
-        "website": website,
+        "phone": details["phone"],
+        "website": details["website"],
         "rating": rating,
         "reviews": reviews,
     }
@@ -613,15 +900,28 @@ async def enrich_card_with_site(
     client: httpx.AsyncClient,
     card_data: Dict[str, Any],
     semaphore: asyncio.Semaphore,
+    executor: Optional[Executor] = None,
+    site_cache: Optional[Dict[str, Dict[str, Any]]] = None,
 ) -> BusinessRecord:
-    """Arricchisce i dati della card con analisi sito web (con semaforo per limitare parallelismo)."""
+    """Arricchisce i dati della card con analisi sito web (con semaforo per limitare parallelismo).
+
+    Con site_cache (vedi load_site_cache) i siti già analizzati in esecuzioni precedenti non vengono riscaricati.
+    """
     async with semaphore:  # Limita il numero di richieste simultanee
         website = card_data.get("website", "")
         ts = datetime.now(timezone.utc).isoformat()
         
-        if website:
+        cache_key = normalize_website(website)
+        cached = site_cache.get(cache_key) if site_cache is not None and cache_key else None
+        if cached:
+            log(f"      Analisi sito da cache: {website}")
+            email, migliorabile, note = cached["email"], cached["migliorabile"], cached["note"]
+        elif website:
             log(f"      Analisi sito: {website}")
-            email, migliorabile, note = await enrich_with_site(client, website)
+            email, migliorabile, note = await enrich_with_site(client, website, executor)
+            # Esito vuoto (nessuna email né nota): forse il sito non ha risposto, meglio riprovare la prossima volta
+            if site_cache is not None and (email or note):
+                site_cache[cache_key] = {"email": email, "migliorabile": migliorabile, "note": note, "timestamp": ts}
             if email:
                 log(f"      Email trovata: {email}")
             else:
@@ -659,7 +959,17 @@ async def scrape_query(
     max_per_query: int,
     delay_range: Tuple[float, float],
     max_concurrent: int = 5,
+    executor: Optional[Executor] = None,
+    semaphore: Optional[asyncio.Semaphore] = None,
+    fast_cards: bool = False,
+    site_cache: Optional[Dict[str, Dict[str, Any]]] = None,
+    on_cards_read: Optional[Callable[[], Awaitable[None]]] = None,
 ) -> List[BusinessRecord]:
+    """Legge le card di una query e ne analizza i siti.
+
+    on_cards_read viene atteso appena finita la lettura delle card, prima di aspettare
+    le analisi dei siti: serve a restituire la pagina al pool il prima possibile.
+    """
     business_keyword = query.get("keyword", "").strip()
     city = query.get("city", "").strip()
     term = f"{business_keyword} {city}"
@@ -676,39 +986,72 @@ async def scrape_query(
     
     # Fase 1: Estrai dati base da tutte le card (sequenziale - necessario per Playwright)
     log(f"Estrazione dati base da {min(target, cards_count)} card...")
-    card_data_list: List[Dict[str, Any]] = []
-    for idx in range(min(target, cards_count)):
-        log(f"  Processando card {idx + 1}/{min(target, cards_count)}...")
-        card_data = await scrape_card_basic(page, idx, term, business_keyword, city, delay_range)
-        if card_data:
-            card_data_list.append(card_data)
-            log(f"    ✓ {card_data.get('name') or 'Senza nome'} - {card_data.get('city')}")
-        else:
-            log(f"    ✗ Card {idx + 1} saltata (errore o dati mancanti)", "WARNING")
-    
-    # Fase 2: Analizza tutti i siti web in parallelo (velocizza molto!)
-    if card_data_list:
-        log(f"Analisi siti web in parallelo ({len(card_data_list)} card, max {max_concurrent} simultanee)...")
+    # Con fast_cards le card che nella lista mostrano già sito e telefono non vanno aperte:
+    # un solo evaluate per tutte. Di default si aprono tutte, per avere l'indirizzo completo
+    feed_cards: List[Dict[str, str]] = []
+    if fast_cards:
+        try:
+            feed_cards = await page.evaluate(FEED_CARDS_JS)
+        except Exception as e:
+            log(f"  Lettura lista risultati non riuscita, apro tutte le card: {e}", "WARNING")
+    # Semaforo condiviso tra le query in parallelo: il limite --max-concurrent resta globale
+    if semaphore is None:
         semaphore = asyncio.Semaphore(max_concurrent)
-        tasks = [enrich_card_with_site(client, card_data, semaphore) for card_data in card_data_list]
-        records = await asyncio.gather(*tasks, return_exceptions=True)
-        
-        # Filtra eventuali errori
-        valid_records: List[BusinessRecord] = []
-        for i, rec in enumerate(records):
-            if isinstance(rec, Exception):
-                log(f"    ✗ Errore analisi card {i + 1}: {rec}", "ERROR")
-            elif rec:
-                valid_records.append(rec)
-                if rec.email:
-                    log(f"      Email: {rec.email}")
-                if rec.website:
-                    log(f"      Website: {rec.website}")
-                    log(f"      Migliorabile: {'Sì' if rec.migliorabile else 'No'}")
-        
-        return valid_records
+    records: List[Optional[BusinessRecord]] = []
+
+    async def enrich_slot(i: int, card_data: Dict[str, Any]) -> None:
+        # Errore su una card: registrato qui, le altre analisi proseguono
+        try:
+            records[i] = await enrich_card_with_site(client, card_data, semaphore, executor, site_cache)
+        except Exception as e:
+            log(f"    ✗ Errore analisi card {i + 1}: {e}", "ERROR")
+
+    # Fase 2 in pipeline con la fase 1: ogni card va in analisi appena letta,
+    # così i siti si scaricano mentre si aprono le card successive
+    tasks: List[asyncio.Task] = []
+    from_list = 0
+    try:
+        for idx in range(min(target, cards_count)):
+            log(f"  Processando card {idx + 1}/{min(target, cards_count)}...")
+            feed_card = feed_cards[idx] if idx < len(feed_cards) else None
+            if feed_card and feed_card["name"] and feed_card["website"] and feed_card["phone"]:
+                card_data = build_card_data(feed_card, term, business_keyword, city, city_from_address=False)
+                from_list += 1
+            else:
+                card_data = await scrape_card_basic(page, idx, term, business_keyword, city, delay_range)
+            if card_data:
+                records.append(None)
+                tasks.append(asyncio.create_task(enrich_slot(len(records) - 1, card_data)))
+                log(f"    ✓ {card_data.get('name') or 'Senza nome'} - {card_data.get('city')}")
+            else:
+                log(f"    ✗ Card {idx + 1} saltata (errore o dati mancanti)", "WARNING")
+
+        if fast_cards:
+            # Se i selettori della lista smettono di funzionare, qui si vede subito 0
+            log(f"Card lette dalla lista senza aprirle: {from_list}/{min(target, cards_count)}")
+
+        # La pagina non serve più: un'altra query può usarla mentre le analisi finiscono
+        if on_cards_read is not None:
+            await on_cards_read()
+        if tasks:
+            log(f"Attesa analisi siti web ({len(tasks)} card, max {max_concurrent} simultanee)...")
+        # Nessuna eccezione arriva a gather (le gestisce enrich_slot)
+        await asyncio.gather(*tasks)
+    finally:
+        # Interruzione (Ctrl+C) o errore della pagina: nessuna analisi resta orfana
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    valid_records = [rec for rec in records if rec]
+    for rec in valid_records:
+        if rec.email:
+            log(f"      Email: {rec.email}")
+        if rec.website:
+            log(f"      Website: {rec.website}")
+            log(f"      Migliorabile: {'Sì' if rec.migliorabile else 'No'}")
     
-    return []
+    return valid_records
 
 
 def save_records_to_json(records: Sequence[BusinessRecord], filepath: str) -> None:
@@ -716,20 +1059,72 @@ def save_records_to_json(records: Sequence[BusinessRecord], filepath: str) -> No
     data = {
         "timestamp": datetime.now(timezone.utc).isoformat(),
         "total_records": len(records),
-        "records": [r.to_dict() for r in records],
+        "records": list(records),
     }
-    with open(filepath, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    if orjson is not None:
+        # orjson serializza direttamente i dataclass, senza dizionari intermedi
+        payload = orjson.dumps(data, option=orjson.OPT_INDENT_2)
+    else:
+        payload = json.dumps(data, default=BusinessRecord.to_dict, ensure_ascii=False, indent=2).encode("utf-8")
+    with open(filepath, "wb") as f:
+        f.write(payload)
     log(f"Salvati {len(records)} record in {filepath}", "SUCCESS")
 
 
-def load_records_from_json(filepath: str) -> List[BusinessRecord]:
-    """Carica record da un file JSON locale."""
-    with open(filepath, "r", encoding="utf-8") as f:
-        data = json.load(f)
-    records = [BusinessRecord.from_dict(r) for r in data.get("records", [])]
-    log(f"Caricati {len(records)} record da {filepath}", "SUCCESS")
-    return records
+def load_site_cache(filepath: str) -> Dict[str, Dict[str, Any]]:
+    """Esiti dell'analisi siti salvati da esecuzioni precedenti, per sito in forma canonica.
+
+    Le voci più vecchie di SITE_CACHE_MAX_AGE vengono scartate: il sito potrebbe essere cambiato.
+    """
+    try:
+        with open(filepath, "rb") as f:
+            raw = f.read()
+    except FileNotFoundError:
+        log(f"Cache analisi siti non trovata, verrà creata: {filepath}")
+        return {}
+    data = orjson.loads(raw) if orjson is not None else json.loads(raw)
+    cutoff = (datetime.now(timezone.utc) - SITE_CACHE_MAX_AGE).isoformat()
+    cache = {site: entry for site, entry in data.items() if entry.get("timestamp", "") >= cutoff}
+    log(f"Cache analisi siti: {len(cache)} siti validi ({len(data) - len(cache)} scaduti) da {filepath}")
+    return cache
+
+
+def save_site_cache(cache: Dict[str, Dict[str, Any]], filepath: str) -> None:
+    """Salva la cache dell'analisi siti per le esecuzioni successive."""
+    if orjson is not None:
+        payload = orjson.dumps(cache)
+    else:
+        payload = json.dumps(cache, ensure_ascii=False).encode("utf-8")
+    with open(filepath, "wb") as f:
+        f.write(payload)
+    log(f"Cache analisi siti salvata: {len(cache)} siti in {filepath}")
+
+
+def append_records_jsonl(records: Sequence[BusinessRecord], f: BinaryIO) -> None:
+    """Accoda i record a un file JSONL già aperto, un oggetto JSON per riga."""
+    if orjson is not None:
+        payload = b"".join(orjson.dumps(r) + b"\n" for r in records)
+    else:
+        payload = "".join(json.dumps(r.to_dict(), ensure_ascii=False) + "\n" for r in records).encode("utf-8")
+    f.write(payload)
+    # Flush dopo ogni query: se il processo si interrompe, le righe già scritte restano valide
+    f.flush()
+
+
+def iter_records_from_json(filepath: str) -> Iterator[BusinessRecord]:
+    """Legge record da un file JSON locale (.json completo o .jsonl a righe) uno alla volta."""
+    loads = orjson.loads if orjson is not None else json.loads
+    with open(filepath, "rb") as f:
+        if filepath.endswith(".jsonl"):
+            for line in f:
+                if line.strip():
+                    yield BusinessRecord.from_dict(loads(line))
+        elif ijson is not None:
+            for r in ijson.items(f, "records.item"):
+                yield BusinessRecord.from_dict(r)
+        else:
+            for r in loads(f.read()).get("records", []):
+                yield BusinessRecord.from_dict(r)
 
 
 def write_rows(ws, records: Sequence[BusinessRecord]) -> None:
@@ -742,64 +1137,103 @@ def write_rows(ws, records: Sequence[BusinessRecord]) -> None:
     log(f"Preparazione scrittura: {len(rows)} righe su worksheet '{ws.title}'", "INFO")
     log(f"Prima riga esempio: {rows[0]}", "INFO")
     
-    # Verifica se il foglio è vuoto (solo header)
-    try:
-        all_values = ws.get_all_values()
-        current_row_count = len(all_values)
-        log(f"Righe attuali nel foglio: {current_row_count} (incluso header)", "INFO")
-    except Exception as e:
-        log(f"Errore lettura foglio: {e}", "WARNING")
-        current_row_count = 1  # Assume solo header
-    
-    # Retry con backoff esponenziale per errori di connessione
+    # Retry con backoff esponenziale solo per errori temporanei: rete, quota (429) ed errori 5xx.
+    # Errori permanenti (permessi, foglio inesistente, richiesta non valida) escono subito
     max_retries = 5
     base_delay = 2.0
     
     for attempt in range(max_retries):
         try:
-            ws.append_rows(rows, value_input_option="USER_ENTERED")
-            log(f"Scrittura completata: {len(rows)} righe aggiunte su worksheet '{ws.title}'", "SUCCESS")
-            
-            # Verifica che siano state scritte
-            try:
-                new_values = ws.get_all_values()
-                new_row_count = len(new_values)
-                log(f"Verifica: righe totali dopo scrittura: {new_row_count} (dovrebbero essere {current_row_count + len(rows)})", "INFO")
-            except Exception as e:
-                log(f"Impossibile verificare scrittura: {e}", "WARNING")
-            
+            # append_rows invia tutte le righe in una sola chiamata values.append
+            response = ws.append_rows(rows, value_input_option="USER_ENTERED")
+            # La risposta di append indica già righe e range scritti: nessuna rilettura del foglio
+            updates = (response or {}).get("updates", {})
+            log(
+                f"Scrittura completata: {updates.get('updatedRows', len(rows))} righe aggiunte su worksheet "
+                f"'{ws.title}' ({updates.get('updatedRange', 'range non disponibile')})",
+                "SUCCESS",
+            )
             return
-        except (ConnectionError, Exception) as e:
-            if attempt < max_retries - 1:
+        except (APIError, OSError) as e:
+            retryable = not isinstance(e, APIError) or e.code in RETRYABLE_SHEETS_STATUS
+            if retryable and attempt < max_retries - 1:
                 delay = base_delay * (2 ** attempt) + random.uniform(0, 1)
-                log(f"Errore connessione Google Sheets (tentativo {attempt + 1}/{max_retries}), riprovo tra {delay:.1f}s...", "WARNING")
+                if isinstance(e, APIError):
+                    # Con la quota esaurita Google può indicare quanto aspettare
+                    retry_after = e.response.headers.get("Retry-After", "")
+                    if retry_after.isdigit():
+                        delay = float(retry_after)
+                log(f"Errore temporaneo Google Sheets (tentativo {attempt + 1}/{max_retries}), riprovo tra {delay:.1f}s...", "WARNING")
                 log(f"Dettagli errore: {type(e).__name__}: {e}", "WARNING")
                 time.sleep(delay)
             else:
-                log(f"Errore dopo {max_retries} tentativi: {type(e).__name__}: {e}", "ERROR")
+                log(f"Errore dopo {attempt + 1} tentativi: {type(e).__name__}: {e}", "ERROR")
                 raise
 
 
-def dedup_records(records: Sequence[BusinessRecord], existing_websites: set) -> List[BusinessRecord]:
+def normalize_website(website: str) -> str:
+    """Forma canonica di un sito per la deduplicazione: minuscolo, senza schema, 'www.', '/' finale,
+    frammento e parametri di tracciamento (Maps aggiunge spesso ?utm_source=...).
+
+    Gli altri parametri restano, ordinati: in URL come profile.php?id=... o ?page_id=...
+    identificano l'attività.
+    """
+    website = website.strip().lower()
+    if not website:
+        return ""
+    parsed = urlparse(website if "://" in website else f"https://{website}")
+    host = parsed.netloc.removeprefix("www.")
+    path = parsed.path.rstrip("/")
+    params = sorted(
+        (key, value)
+        for key, value in parse_qsl(parsed.query, keep_blank_values=True)
+        if not key.startswith("utm_") and key not in TRACKING_QUERY_PARAMS
+    )
+    return f"{host}{path}?{urlencode(params)}" if params else f"{host}{path}"
+
+
+def website_key(website: str) -> Optional[int]:
+    """Hash a 64 bit della forma canonica del sito (None se vuoto).
+
+    I set di deduplicazione tengono interi invece di stringhe: con decine di migliaia
+    di righe sul foglio occupano molta meno memoria e il confronto è più rapido.
+    """
+    canonical = normalize_website(website)
+    if not canonical:
+        return None
+    return int.from_bytes(hashlib.blake2b(canonical.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def dedup_records(records: Iterable[BusinessRecord], existing_websites: set) -> List[BusinessRecord]:
+    # Confronto sulla forma canonica: "https://www.sito.it/" e "http://sito.it" sono lo stesso sito.
+    # existing_websites contiene già le chiavi intere prodotte da load_existing_websites
     seen = set(existing_websites)
     unique: List[BusinessRecord] = []
     for r in records:
-        website = (r.website or "").strip()
-        if website:
-            if website in seen:
+        key = website_key(r.website or "")
+        if key is not None:
+            if key in seen:
                 continue
-            seen.add(website)
+            seen.add(key)
         unique.append(r)
     return unique
 
 
-def filter_with_email(records: Sequence[BusinessRecord]) -> List[BusinessRecord]:
-    return [r for r in records if (r.email or "").strip()]
+def filter_with_email(records: Iterable[BusinessRecord]) -> Iterator[BusinessRecord]:
+    return (r for r in records if (r.email or "").strip())
 
 
-def filter_only_bad_sites(records: Sequence[BusinessRecord]) -> List[BusinessRecord]:
+def filter_only_bad_sites(records: Iterable[BusinessRecord]) -> Iterator[BusinessRecord]:
     """Filtra SOLO i business con siti che fanno veramente cagare (migliorabile=True)."""
-    return [r for r in records if r.migliorabile]
+    return (r for r in records if r.migliorabile)
+
+
+def count_into(records: Iterable[BusinessRecord], counts: Dict[str, int], key: str) -> Iterator[BusinessRecord]:
+    """Lascia passare i record invariati contando quanti ne transitano in counts[key]."""
+    counts[key] = 0
+    for r in records:
+        counts[key] += 1
+        yield r
 
 
 async def run() -> None:
@@ -812,7 +1246,10 @@ async def run() -> None:
     log(f"Max per query: {args.max_per_query}")
     log(f"Delay: {args.min_delay}-{args.max_delay} secondi")
     log(f"Max analisi parallele: {args.max_concurrent}")
+    log(f"Processi analisi HTML: {args.parse_workers or 'nessuno (processo principale)'}")
     log(f"Headless: {not args.headful}")
+    log(f"Blocco risorse pesanti: {not args.no_block_resources}")
+    log(f"Card veloci (dalla lista risultati): {args.fast_cards}")
     
     queries = load_queries(args.queries_file, args.max_per_query)
     log(f"Query da processare: {len(queries)}")
@@ -821,6 +1258,10 @@ async def run() -> None:
     
     if args.min_delay > args.max_delay:
         raise ValueError("min-delay deve essere <= max-delay")
+    if args.browser_contexts < 1:
+        raise ValueError("--browser-contexts deve essere >= 1")
+    if args.parse_workers < 0:
+        raise ValueError("--parse-workers deve essere >= 0")
     
     # Validazione argomenti
     if not args.load_from and not args.sheet_id:
@@ -831,14 +1272,18 @@ async def run() -> None:
         save_file = args.save_to
     else:
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        save_file = f"results_{timestamp}.json"
+        save_file = f"results_{timestamp}.jsonl"
+    # Con .jsonl i record vengono accodati query per query, senza riscrivere l'intero file
+    save_jsonl = save_file.endswith(".jsonl")
     
     # Se --load-from è specificato, carica da file e salta lo scraping
     if args.load_from:
         log(f"Caricamento da file: {args.load_from}")
-        all_records = load_records_from_json(args.load_from)
+        # Letto in streaming: in memoria restano solo i record che superano i filtri
+        all_records = iter_records_from_json(args.load_from)
     else:
         # Fase di scraping
+        site_cache = load_site_cache(args.site_cache) if args.site_cache else None
         log("Avvio browser Playwright...")
         async with async_playwright() as p:
             browser: Browser = await p.chromium.launch(
@@ -846,37 +1291,101 @@ async def run() -> None:
                 args=["--disable-blink-features=AutomationControlled"],
             )
             log("Browser avviato", "SUCCESS")
-            page = await browser.new_page(user_agent=HEADERS["User-Agent"], viewport={"width": 1300, "height": 900})
-            async with httpx.AsyncClient(headers=HEADERS) as http_client:
-                all_records: List[BusinessRecord] = []
-                for query_idx, item in enumerate(queries, 1):
-                    log("")
-                    log(f"QUERY {query_idx}/{len(queries)}: {item.get('keyword')} - {item.get('city')}", "PROGRESS")
-                    recs = await scrape_query(
-                        page,
-                        http_client,
-                        item,
-                        max_per_query=args.max_per_query,
-                        delay_range=(args.min_delay, args.max_delay),
-                        max_concurrent=args.max_concurrent,
+            async with AsyncExitStack() as stack:
+                # Pool di pagine, una per contesto: ogni query prende una pagina libera
+                pool: asyncio.Queue[Page] = asyncio.Queue()
+                storage_state = args.browser_state if args.browser_state and os.path.exists(args.browser_state) else None
+                if storage_state:
+                    log(f"Stato browser ripristinato da: {storage_state}")
+                contexts: List[BrowserContext] = []
+                for _ in range(max(1, min(args.browser_contexts, len(queries)))):
+                    context, page = await open_browser_context(browser, not args.no_block_resources, storage_state)
+                    stack.push_async_callback(context.close)
+                    contexts.append(context)
+                    pool.put_nowait(page)
+                log(f"Contesti browser attivi: {pool.qsize()}")
+                http_client = await stack.enter_async_context(
+                    httpx.AsyncClient(
+                        headers=HEADERS,
+                        limits=HTTP_LIMITS,
+                        timeout=HTTP_TIMEOUT,
+                        http2=True,
+                        follow_redirects=True,
                     )
-                    log(f"Trovati {len(recs)} business per questa query")
-                    all_records.extend(recs)
-                    
-                    # Salva progressivamente dopo ogni query
-                    if all_records:
-                        save_records_to_json(all_records, save_file)
-                        log(f"Progresso salvato: {len(all_records)} record totali in {save_file}")
-                    
-                    if query_idx < len(queries):
-                        # Delay minimo tra query per evitare rate limiting
-                        await page.wait_for_timeout(200)  # Ridotto ulteriormente per velocità
+                )
+
+                # Analisi HTML in processi separati: il parsing non blocca il loop asyncio
+                parse_pool = None
+                if args.parse_workers > 0:
+                    parse_pool = stack.enter_context(ProcessPoolExecutor(max_workers=args.parse_workers))
+
+                # Un solo limite di analisi siti per tutte le query in corso
+                site_semaphore = asyncio.Semaphore(args.max_concurrent)
+
+                jsonl_file = stack.enter_context(open(save_file, "wb")) if save_jsonl else None
+
+                # Risultati per query, così l'ordine finale non dipende da quale finisce prima
+                results: List[List[BusinessRecord]] = [[] for _ in queries]
+
+                async def scrape_on_pool(query_idx: int, item: Dict[str, Any]) -> None:
+                    page = await pool.get()
+                    released = False
+
+                    async def release_page() -> None:
+                        # Chiamata da scrape_query appena lette le card: le analisi dei siti
+                        # proseguono senza tenere occupata la pagina
+                        nonlocal released
+                        if released:
+                            return
+                        # Delay minimo prima di riusare la pagina per evitare rate limiting
+                        await page.wait_for_timeout(200)
+                        released = True
+                        pool.put_nowait(page)
+
+                    try:
+                        log("")
+                        log(f"QUERY {query_idx}/{len(queries)}: {item.get('keyword')} - {item.get('city')}", "PROGRESS")
+                        recs = await scrape_query(
+                            page,
+                            http_client,
+                            item,
+                            max_per_query=args.max_per_query,
+                            delay_range=(args.min_delay, args.max_delay),
+                            max_concurrent=args.max_concurrent,
+                            executor=parse_pool,
+                            semaphore=site_semaphore,
+                            fast_cards=args.fast_cards,
+                            site_cache=site_cache,
+                            on_cards_read=release_page,
+                        )
+                        log(f"Trovati {len(recs)} business per la query {query_idx}")
+                        results[query_idx - 1] = recs
+
+                        # Salva progressivamente dopo ogni query (solo le righe nuove)
+                        if jsonl_file is not None and recs:
+                            append_records_jsonl(recs, jsonl_file)
+                            log(f"Progresso salvato: {len(recs)} record aggiunti a {save_file}")
+                    finally:
+                        if not released:
+                            released = True
+                            pool.put_nowait(page)
+
+                await asyncio.gather(*(scrape_on_pool(i, item) for i, item in enumerate(queries, 1)))
+                all_records = [r for recs in results for r in recs]
+
+                # Cookie e consenso per la prossima esecuzione (i contesti li condividono tutti)
+                if args.browser_state:
+                    await contexts[0].storage_state(path=args.browser_state)
+                    log(f"Stato browser salvato in: {args.browser_state}")
             await browser.close()
             log("Browser chiuso")
+        if site_cache is not None:
+            save_site_cache(site_cache, args.site_cache)
         
-        # Salva tutti i risultati finali
+        # Salva tutti i risultati finali (il .jsonl è già completo)
         if all_records:
-            save_records_to_json(all_records, save_file)
+            if not save_jsonl:
+                save_records_to_json(all_records, save_file)
             log(f"Tutti i risultati salvati in: {save_file}", "SUCCESS")
     
     # Fase di elaborazione e caricamento su Google Sheets
@@ -884,16 +1393,19 @@ async def run() -> None:
     log("=" * 60)
     log("Elaborazione risultati", "PROGRESS")
     log("=" * 60)
-    log(f"Totale business trovati: {len(all_records)}")
     
-    if all_records:
-        # Filtro 1: solo quelli con email
-        with_email = filter_with_email(all_records)
-        log(f"Dopo filtro email: {len(with_email)} business (rimossi {len(all_records) - len(with_email)} senza email)")
-        
-        # Filtro 2: solo quelli con siti che fanno veramente cagare
-        bad_sites = filter_only_bad_sites(with_email)
-        log(f"Dopo filtro siti migliorabili: {len(bad_sites)} business (rimossi {len(with_email) - len(bad_sites)} con siti OK)")
+    # Filtro 1: solo quelli con email; filtro 2: solo quelli con siti che fanno veramente cagare.
+    # I filtri sono generatori in catena: un solo passaggio sui record, contando per i log
+    counts: Dict[str, int] = {}
+    with_email = count_into(filter_with_email(count_into(all_records, counts, "totale")), counts, "email")
+    bad_sites = list(filter_only_bad_sites(with_email))
+    if args.load_from:
+        log(f"Caricati {counts['totale']} record da {args.load_from}", "SUCCESS")
+    log(f"Totale business trovati: {counts['totale']}")
+    
+    if counts["totale"]:
+        log(f"Dopo filtro email: {counts['email']} business (rimossi {counts['totale'] - counts['email']} senza email)")
+        log(f"Dopo filtro siti migliorabili: {len(bad_sites)} business (rimossi {counts['email'] - len(bad_sites)} con siti OK)")
         
         # Connessione a Google Sheets solo se dobbiamo scrivere e sheet-id è specificato
         if bad_sites and args.sheet_id: